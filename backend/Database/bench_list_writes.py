@@ -0,0 +1,77 @@
+"""
+Benchmark: grocery list item writes, row-by-row INSERTs vs. the batched
+insert_list_items() path, across list sizes.
+
+Run from backend/ against a local database:
+    python -m Database.bench_list_writes
+
+Every measurement runs inside a transaction that is rolled back, so the
+benchmark leaves no rows behind.
+"""
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from . import db_utils
+from .product import Product
+
+LIST_SIZES = [1, 10, 40, 80, 160, 320]
+REPEATS = 7
+
+def make_products(n):
+    now = datetime.now(timezone.utc)
+    return [
+        (Product(name=f"Bench item {i}", price=1.99, promo_price=None, fulfillment_type="PICKUP",
+                 brand="Bench", inventory="HIGH", size="1 ea", last_updated=now,
+                 location_ID="70100000", upc=f"{i:013d}"), 1)
+        for i in range(n)
+    ]
+
+def insert_row_by_row(cur, list_id, products_on_list):
+    """The pre-batching write path, kept here as the baseline."""
+    for product, quantity in products_on_list:
+        cur.execute("""
+            INSERT INTO grocery_list_items (
+                list_id, name, price, promo_price, fulfillment_type, brand,
+                inventory, size, last_updated, location_id, upc, quantity, category
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+        """, (
+            list_id, product.name, product.price, product.promo_price,
+            product.fulfillment_type, product.brand, product.inventory, product.size,
+            product.last_updated, product.location_ID, product.upc, quantity, product.category
+        ))
+
+def time_insert(conn, insert_fn, products_on_list):
+    user_id = str(uuid.uuid4())
+    list_id = str(uuid.uuid4())
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (user_id, username, email, password) VALUES (%s, %s, %s, %s);",
+                    (user_id, "bench", f"{user_id}@bench.invalid", "bench"))
+        cur.execute("INSERT INTO grocery_lists (list_id, user_id, name, timestamp) VALUES (%s, %s, %s, %s);",
+                    (list_id, user_id, "bench", datetime.now(timezone.utc)))
+        start = time.perf_counter()
+        insert_fn(cur, list_id, products_on_list)
+        elapsed = time.perf_counter() - start
+    conn.rollback()
+    return elapsed
+
+def run_benchmark():
+    db_utils.create_tables()
+    with db_utils.db_connection() as conn:
+        if conn is None:
+            print("❌ Database connection failed")
+            return
+        print(f"{'items':>6} | {'row-by-row ms':>14} | {'batched ms':>11} | {'speedup':>7}")
+        print("-" * 48)
+        for size in LIST_SIZES:
+            products = make_products(size)
+            single = [time_insert(conn, insert_row_by_row, products) for _ in range(REPEATS)]
+            batched = [time_insert(conn, db_utils.insert_list_items, products) for _ in range(REPEATS)]
+            single_ms = statistics.median(single) * 1000
+            batched_ms = statistics.median(batched) * 1000
+            print(f"{size:>6} | {single_ms:>14.2f} | {batched_ms:>11.2f} | {single_ms / batched_ms:>6.1f}x")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -1,9 +1,18 @@
+import base64
+import copy
+import os
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql
 import json
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
 from .list import GroceryList
 from .product import Product
 from .user import User
+from .pool import ConnectionPool
+from . import migrations
+from cache import TTLCache
 
 DB_NAME = "grocery_app"
 DB_USER = "samavramov"
@@ -11,84 +20,61 @@ DB_PASSWORD = ""
 DB_HOST = "localhost"
 DB_PORT = "5432"
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
-        return conn
-    except psycopg2.Error as e:
-        print(f"Error connecting to database: {e}")
-        return None
+# Pool sizing; override per deployment via the environment.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+
+_pool = ConnectionPool(
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE,
+    dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+)
+
+# Authenticated-user cache used by token_required; entries are dropped on profile writes.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, name="users")
+
+def db_connection():
+    """
+    Context manager that borrows a pooled connection:
+
+        with db_connection() as conn:
+            if conn is None: return ...
+
+    The connection goes back to the pool on exit; uncommitted work is rolled back.
+    """
+    return _pool.connection()
+
+def pool_stats():
+    """Returns a snapshot of connection pool counters for monitoring."""
+    return _pool.stats()
+
+def close_pool():
+    """Closes every pooled connection (e.g. on worker shutdown)."""
+    _pool.close()
 
 def create_tables():
-    conn = get_db_connection()
-    if conn is None: return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    username TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    access_token TEXT,
-                    refresh_token TEXT,
-                    token_type TEXT,
-                    token_expiry TIMESTAMP WITH TIME ZONE,
-                    list_of_list_ids JSONB DEFAULT '[]'::jsonb,
-                    first_name TEXT,
-                    last_name TEXT,
-                    preferred_location TEXT,
-                    budget INTEGER,
-                    shopping_frequency TEXT,
-                    shopping_priority TEXT,
-                    dietary_restrictions JSONB,
-                    allergies JSONB,
-                    health_goals TEXT,
-                    favorite_cuisines JSONB,
-                    cultural_background TEXT,
-                    favorite_foods TEXT,
-                    age INTEGER,
-                    gender TEXT
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS grocery_lists (
-                    list_id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
-                    name TEXT NOT NULL DEFAULT 'My Grocery List',
-                    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS grocery_list_items (
-                    list_item_id SERIAL PRIMARY KEY,
-                    list_id TEXT NOT NULL REFERENCES grocery_lists(list_id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    price NUMERIC(10, 2),
-                    promo_price NUMERIC(10, 2),
-                    fulfillment_type TEXT,
-                    brand TEXT,
-                    inventory TEXT,
-                    size TEXT,
-                    last_updated TIMESTAMP WITH TIME ZONE,
-                    location_id TEXT,
-                    upc TEXT,
-                    quantity INTEGER NOT NULL DEFAULT 1,
-                    category TEXT
-                );
-            """)
-        conn.commit()
-        print("✅ Tables ensured to exist.")
-    except psycopg2.Error as e:
-        print(f"Error creating tables: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    """Brings the schema up to date by applying any pending migrations (see migrations.py)."""
+    with db_connection() as conn:
+        if conn is None: return
+        try:
+            applied = migrations.apply_migrations(conn)
+            if applied:
+                print(f"✅ Schema migrated to version {applied[-1]}.")
+            else:
+                print("✅ Schema is up to date.")
+        except psycopg2.Error as e:
+            print(f"Error applying migrations: {e}")
 
 def get_user_by_id(user_id):
-    conn = get_db_connection()
-    if conn is None: return None
-    try:
+    with db_connection() as conn:
+        if conn is None: return None
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
             cur.execute("SELECT * FROM users WHERE user_id = %s;", (user_id,))
             user_data = cur.fetchone()
@@ -119,169 +105,576 @@ def get_user_by_id(user_id):
                     gender=user_data.get('gender')
                 )
             return None
-    finally:
-        conn.close()
+
+def get_cached_user(user_id):
+    """
+    Like get_user_by_id, but served from the in-process user cache when possible.
+    Returns a copy, so callers may mutate it freely before update_user_details().
+    """
+    user = _user_cache.get(user_id)
+    if user is None:
+        user = get_user_by_id(user_id)
+        if user is None:
+            return None
+        _user_cache.set(user_id, user)
+    return copy.deepcopy(user)
+
+def invalidate_cached_user(user_id):
+    _user_cache.invalidate(user_id)
+
+def user_cache_stats():
+    """Returns hit/miss/eviction counters for the user cache."""
+    return _user_cache.stats()
 
 def add_user_to_db(user_obj):
-    conn = get_db_connection()
-    if conn is None: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO users (user_id, username, email, password)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (email) DO NOTHING;
-            """, (user_obj.user_id, user_obj.username, user_obj.email, user_obj.password))
-        conn.commit()
-        return True
-    except psycopg2.Error as e:
-        print(f"Error adding user '{user_obj.username}': {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO users (user_id, username, email, password)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (email) DO NOTHING;
+                """, (user_obj.user_id, user_obj.username, user_obj.email, user_obj.password))
+            conn.commit()
+            return True
+        except psycopg2.Error as e:
+            print(f"Error adding user '{user_obj.username}': {e}")
+            conn.rollback()
+            return False
 
 def update_user_details(user_obj):
-    conn = get_db_connection()
-    if conn is None: return False
-    try:
-        with conn.cursor() as cur:
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE users SET
+                        username = %s, email = %s, first_name = %s, last_name = %s,
+                        preferred_location = %s, budget = %s, shopping_frequency = %s,
+                        shopping_priority = %s, dietary_restrictions = %s, allergies = %s,
+                        health_goals = %s, favorite_cuisines = %s, cultural_background = %s,
+                        favorite_foods = %s, age = %s, gender = %s
+                    WHERE user_id = %s;
+                """, (
+                    user_obj.username, user_obj.email, user_obj.first_name, user_obj.last_name,
+                    user_obj.preferred_location, user_obj.budget, user_obj.shopping_frequency,
+                    user_obj.shopping_priority, json.dumps(user_obj.dietary_restrictions),
+                    json.dumps(user_obj.allergies), user_obj.health_goals,
+                    json.dumps(user_obj.favorite_cuisines), user_obj.cultural_background,
+                    user_obj.favorite_foods, user_obj.age, user_obj.gender,
+                    user_obj.user_id
+                ))
+            conn.commit()
+            invalidate_cached_user(user_obj.user_id)
+            print(f"✅ User '{user_obj.username}' details updated successfully.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Error updating user '{user_obj.username}': {e}")
+            conn.rollback()
+            return False
+
+def get_user_tokens(user_id):
+    """
+    Returns the user's stored Kroger OAuth tokens as
+    {'access_token', 'refresh_token', 'token_type', 'token_expiry'}, or None.
+    """
+    with db_connection() as conn:
+        if conn is None: return None
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
             cur.execute("""
-                UPDATE users SET
-                    username = %s, email = %s, first_name = %s, last_name = %s,
-                    preferred_location = %s, budget = %s, shopping_frequency = %s,
-                    shopping_priority = %s, dietary_restrictions = %s, allergies = %s,
-                    health_goals = %s, favorite_cuisines = %s, cultural_background = %s,
-                    favorite_foods = %s, age = %s, gender = %s
-                WHERE user_id = %s;
-            """, (
-                user_obj.username, user_obj.email, user_obj.first_name, user_obj.last_name,
-                user_obj.preferred_location, user_obj.budget, user_obj.shopping_frequency,
-                user_obj.shopping_priority, json.dumps(user_obj.dietary_restrictions),
-                json.dumps(user_obj.allergies), user_obj.health_goals,
-                json.dumps(user_obj.favorite_cuisines), user_obj.cultural_background,
-                user_obj.favorite_foods, user_obj.age, user_obj.gender,
-                user_obj.user_id
-            ))
-        conn.commit()
-        print(f"✅ User '{user_obj.username}' details updated successfully.")
-        return True
-    except psycopg2.Error as e:
-        print(f"Error updating user '{user_obj.username}': {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+                SELECT access_token, refresh_token, token_type, token_expiry
+                FROM users WHERE user_id = %s;
+            """, (user_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+def save_user_tokens(user_id, access_token, refresh_token, token_type, token_expiry):
+    """Stores the user's Kroger OAuth tokens in a single UPDATE."""
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE users SET access_token = %s, refresh_token = %s, token_type = %s, token_expiry = %s
+                    WHERE user_id = %s;
+                """, (access_token, refresh_token, token_type, token_expiry, user_id))
+                updated = cur.rowcount > 0
+            conn.commit()
+            invalidate_cached_user(user_id)
+            return updated
+        except psycopg2.Error as e:
+            print(f"Error saving tokens for user {user_id}: {e}")
+            conn.rollback()
+            return False
+
+def refresh_user_tokens(user_id, refresh):
+    """
+    Read-refresh-write of the user's Kroger OAuth tokens in one transaction.
+
+    The users row is locked (SELECT ... FOR UPDATE) while `refresh` runs, so a
+    refresh in another worker waits and then sees the tokens this one stored.
+
+    Args:
+        refresh: Called with the stored token columns (as get_user_tokens returns
+            them); returns the columns to store, or None to store nothing
+
+    Returns:
+        dict: The token columns now stored, or None if there is no such user,
+        `refresh` returned None, or the write failed
+    """
+    with db_connection() as conn:
+        if conn is None: return None
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute("""
+                    SELECT access_token, refresh_token, token_type, token_expiry
+                    FROM users WHERE user_id = %s FOR UPDATE;
+                """, (user_id,))
+                row = cur.fetchone()
+                if row is None:
+                    conn.rollback()
+                    return None
+                current = dict(row)
+                tokens = refresh(dict(current))
+                if tokens is None or tokens == current:
+                    conn.rollback()
+                    return tokens
+                cur.execute("""
+                    UPDATE users SET access_token = %s, refresh_token = %s, token_type = %s, token_expiry = %s
+                    WHERE user_id = %s;
+                """, (tokens['access_token'], tokens['refresh_token'], tokens['token_type'],
+                      tokens['token_expiry'], user_id))
+            conn.commit()
+            invalidate_cached_user(user_id)
+            return tokens
+        except psycopg2.Error as e:
+            print(f"Error refreshing tokens for user {user_id}: {e}")
+            conn.rollback()
+            return None
+
+# Rows per multi-row INSERT statement; a 500-line list still goes out in one round trip.
+ITEM_INSERT_PAGE_SIZE = 500
+
+def insert_list_items(cur, list_id, products_on_list):
+    """
+    Inserts every (Product, quantity) pair for `list_id` using multi-row
+    INSERT statements (execute_values) instead of one statement per item.
+    Runs on the caller's cursor so it shares the caller's transaction.
+    """
+    if not products_on_list:
+        return
+    rows = [
+        (
+            list_id, product.name, product.price, product.promo_price,
+            product.fulfillment_type, product.brand, product.inventory, product.size,
+            product.last_updated, product.location_ID, product.upc, quantity, product.category
+        )
+        for product, quantity in products_on_list
+    ]
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO grocery_list_items (
+            list_id, name, price, promo_price, fulfillment_type, brand,
+            inventory, size, last_updated, location_id, upc, quantity, category
+        )
+        VALUES %s;
+    """, rows, page_size=ITEM_INSERT_PAGE_SIZE)
 
 def add_grocery_list_to_db(grocery_list_obj):
-    conn = get_db_connection()
-    if conn is None: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO grocery_lists (list_id, user_id, name, timestamp)
-                VALUES (%s, %s, %s, %s);
-            """, (grocery_list_obj.list_id, grocery_list_obj.user_id, grocery_list_obj.name, grocery_list_obj.timestamp))
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO grocery_lists (list_id, user_id, name, timestamp)
+                    VALUES (%s, %s, %s, %s);
+                """, (grocery_list_obj.list_id, grocery_list_obj.user_id, grocery_list_obj.name, grocery_list_obj.timestamp))
+
+                insert_list_items(cur, grocery_list_obj.list_id, grocery_list_obj.products_on_list)
+        
+            conn.commit()
+            print(f"✅ Grocery list '{grocery_list_obj.name}' saved successfully.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Error adding grocery list: {e}")
+            conn.rollback()
+            return False
+
+LIST_ITEM_COLUMNS = (
+    "list_item_id", "list_id", "name", "price", "promo_price", "fulfillment_type", "brand",
+    "inventory", "size", "last_updated", "location_id", "upc", "quantity", "category"
+)
+
+def encode_list_cursor(list_data):
+    """
+    Builds the opaque pagination cursor pointing just past `list_data`.
+    Base64url without padding, so it is safe to drop into a query string unescaped
+    (a raw isoformat() carries a '+' that would decode as a space).
+    """
+    raw = f"{list_data['timestamp'].isoformat()}|{list_data['list_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_list_cursor(cursor):
+    """
+    Splits a cursor from encode_list_cursor() back into (timestamp, list_id).
+    Raises ValueError for anything that isn't such a cursor.
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+    timestamp, sep, list_id = raw.partition("|")
+    if not sep or not list_id:
+        raise ValueError("Malformed list cursor")
+    return datetime.fromisoformat(timestamp), list_id
 
-            for product, quantity in grocery_list_obj.products_on_list:
+def _load_lists_for_user(user_id, limit=None, cursor=None):
+    """
+    Loads a user's lists (newest first) together with their items in a single query.
+
+    The page of lists is selected in a CTE keyed on (timestamp, list_id) so that
+    LIMIT applies to lists rather than joined item rows, then the items are
+    LEFT JOINed and folded into the nested structure in one pass over the rows.
+    """
+    cursor_ts, cursor_id = decode_list_cursor(cursor) if cursor else (None, None)
+    with db_connection() as conn:
+        if conn is None: return []
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
                 cur.execute("""
-                    INSERT INTO grocery_list_items (
-                        list_id, name, price, promo_price, fulfillment_type, brand,
-                        inventory, size, last_updated, location_id, upc, quantity, category
+                    WITH page AS (
+                        SELECT list_id, user_id, name, timestamp
+                        FROM grocery_lists
+                        WHERE user_id = %(user_id)s
+                          AND (%(cursor_ts)s::timestamptz IS NULL
+                               OR (timestamp, list_id) < (%(cursor_ts)s::timestamptz, %(cursor_id)s))
+                        ORDER BY timestamp DESC, list_id DESC
+                        LIMIT %(limit)s
                     )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-                """, (
-                    grocery_list_obj.list_id, product.name, product.price, product.promo_price,
-                    product.fulfillment_type, product.brand, product.inventory, product.size,
-                    product.last_updated, product.location_ID, product.upc, quantity, product.category
-                ))
-        
-        conn.commit()
-        print(f"✅ Grocery list '{grocery_list_obj.name}' saved successfully.")
-        return True
-    except psycopg2.Error as e:
-        print(f"Error adding grocery list: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+                    SELECT page.list_id AS l_list_id, page.user_id AS l_user_id,
+                           page.name AS l_name, page.timestamp AS l_timestamp, items.*
+                    FROM page
+                    LEFT JOIN grocery_list_items items ON items.list_id = page.list_id
+                    ORDER BY page.timestamp DESC, page.list_id DESC, items.list_item_id;
+                """, {"user_id": user_id, "cursor_ts": cursor_ts, "cursor_id": cursor_id, "limit": limit})
+
+                lists = []
+                current = None
+                for row in cur:
+                    if current is None or current['list_id'] != row['l_list_id']:
+                        current = {
+                            'list_id': row['l_list_id'],
+                            'user_id': row['l_user_id'],
+                            'name': row['l_name'],
+                            'timestamp': row['l_timestamp'],
+                            'items': []
+                        }
+                        lists.append(current)
+                    if row['list_item_id'] is not None:
+                        current['items'].append({col: row[col] for col in LIST_ITEM_COLUMNS})
+            return lists
+        except psycopg2.Error as e:
+            print(f"Error getting lists for user: {e}")
+            return []
+
+def get_grocery_list(list_id, user_id):
+    """Loads one of the user's lists as a GroceryList of (Product, quantity) pairs, or None."""
+    with db_connection() as conn:
+        if conn is None: return None
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute("""
+                    SELECT gl.list_id AS l_list_id, gl.user_id AS l_user_id,
+                           gl.name AS l_name, gl.timestamp AS l_timestamp, items.*
+                    FROM grocery_lists gl
+                    LEFT JOIN grocery_list_items items ON items.list_id = gl.list_id
+                    WHERE gl.list_id = %s AND gl.user_id = %s
+                    ORDER BY items.list_item_id;
+                """, (list_id, user_id))
+                rows = cur.fetchall()
+        except psycopg2.Error as e:
+            print(f"Error getting grocery list: {e}")
+            return None
+
+    if not rows:
+        return None
+    products_on_list = [
+        (Product(
+            name=row['name'], price=row['price'], promo_price=row['promo_price'],
+            fulfillment_type=row['fulfillment_type'], brand=row['brand'], inventory=row['inventory'],
+            size=row['size'], last_updated=row['last_updated'], location_ID=row['location_id'],
+            upc=row['upc'], category=row['category']
+        ), row['quantity'])
+        for row in rows if row['list_item_id'] is not None
+    ]
+    first = rows[0]
+    return GroceryList(
+        list_id=first['l_list_id'],
+        user_id=first['l_user_id'],
+        name=first['l_name'],
+        timestamp=first['l_timestamp'],
+        products_on_list=products_on_list
+    )
+
+# Largest page get_lists_page_for_user will load, however many lists are asked for.
+LIST_PAGE_MAX = int(os.getenv("LIST_PAGE_MAX", "100"))
 
 def get_all_lists_for_user(user_id):
-    conn = get_db_connection()
-    if conn is None: return []
-    
-    lists = []
-    try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT * FROM grocery_lists WHERE user_id = %s ORDER BY timestamp DESC;", (user_id,))
-            list_records = cur.fetchall()
-
-            for list_record in list_records:
-                cur.execute("SELECT * FROM grocery_list_items WHERE list_id = %s;", (list_record['list_id'],))
-                item_records = cur.fetchall()
-                items = [dict(item) for item in item_records]
-                list_data = dict(list_record)
-                list_data['items'] = items
-                lists.append(list_data)
-        return lists
-    except psycopg2.Error as e:
-        print(f"Error getting lists for user: {e}")
-        return []
-    finally:
-        conn.close()
+    return _load_lists_for_user(user_id)
+
+def get_lists_page_for_user(user_id, limit=20, cursor=None):
+    """
+    Returns (lists, next_cursor) for one page of a user's lists, newest first.
+    `limit` is capped at LIST_PAGE_MAX; `next_cursor` is None once the last page has been reached.
+    """
+    if limit <= 0:
+        raise ValueError("limit must be a positive integer")
+    limit = min(limit, LIST_PAGE_MAX)
+    lists = _load_lists_for_user(user_id, limit=limit, cursor=cursor)
+    next_cursor = encode_list_cursor(lists[-1]) if len(lists) == limit else None
+    return lists, next_cursor
 
 def remove_grocery_list(list_id, user_id):
-    conn = get_db_connection()
-    if conn is None: return False
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM grocery_lists WHERE list_id = %s AND user_id = %s;", (list_id, user_id))
+                conn.commit()
+                if cur.rowcount > 0:
+                    print(f"✅ List {list_id} deleted successfully.")
+                    return True
+                else:
+                    print(f"⚠️ Warning: List {list_id} not found or permission denied for user {user_id}.")
+                    return False
+        except psycopg2.Error as e:
+            print(f"Error removing grocery list: {e}")
+            conn.rollback()
+            return False
+
+# Columns an item-level update may touch, keyed by the attribute name used on Product.
+ITEM_UPDATABLE_FIELDS = {
+    "name": "name", "price": "price", "promo_price": "promo_price",
+    "fulfillment_type": "fulfillment_type", "brand": "brand", "inventory": "inventory",
+    "size": "size", "location_ID": "location_id", "upc": "upc",
+    "quantity": "quantity", "category": "category"
+}
+
+def _normalize_money(value):
+    if value is None:
+        return None
     try:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM grocery_lists WHERE list_id = %s AND user_id = %s;", (list_id, user_id))
+        return Decimal(str(value)).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return value
+
+def _normalize_existing(col, value):
+    return _normalize_money(value) if col in ("price", "promo_price") else value
+
+def _item_fields(product, quantity):
+    """Comparable column values for a (Product, quantity) pair; last_updated is deliberately excluded."""
+    return {
+        "name": product.name,
+        "price": _normalize_money(product.price),
+        "promo_price": _normalize_money(product.promo_price),
+        "fulfillment_type": product.fulfillment_type,
+        "brand": product.brand,
+        "inventory": product.inventory,
+        "size": product.size,
+        "location_id": product.location_ID,
+        "upc": product.upc,
+        "quantity": quantity,
+        "category": product.category
+    }
+
+def _keyed_items(pairs):
+    """
+    Keys items by (upc, location_id, n), where n counts earlier items with the same
+    upc/location. Manually added items all share upc 'N/A', so the occurrence index
+    keeps them distinct and pairs them up in order.
+    """
+    seen = {}
+    keyed = {}
+    for value, fields in pairs:
+        base = (fields["upc"], fields["location_id"])
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        keyed[base + (n,)] = (value, fields)
+    return keyed
+
+def diff_list_items(existing_rows, products_on_list):
+    """
+    Computes the delta between stored item rows and the desired (Product, quantity) list.
+
+    Returns (added, updated, removed):
+        added   -- [(Product, quantity)] to insert
+        updated -- [(list_item_id, {column: value})] with only the changed columns
+        removed -- [list_item_id] to delete
+    """
+    existing = _keyed_items(
+        (row["list_item_id"], {col: row[col] for col in ITEM_UPDATABLE_FIELDS.values()})
+        for row in existing_rows
+    )
+    desired = _keyed_items(
+        ((product, quantity), _item_fields(product, quantity))
+        for product, quantity in products_on_list
+    )
+
+    added = [pair for key, (pair, _) in desired.items() if key not in existing]
+    removed = [list_item_id for key, (list_item_id, _) in existing.items() if key not in desired]
+    updated = []
+    for key, (list_item_id, old_fields) in existing.items():
+        if key not in desired:
+            continue
+        new_fields = desired[key][1]
+        changes = {col: val for col, val in new_fields.items() if _normalize_existing(col, old_fields[col]) != val}
+        if changes:
+            updated.append((list_item_id, changes))
+    return added, updated, removed
+
+def _lock_owned_list(cur, list_id, user_id):
+    """Row-locks the list if `user_id` owns it so concurrent saves of one list serialize."""
+    cur.execute("SELECT list_id FROM grocery_lists WHERE list_id = %s AND user_id = %s FOR UPDATE;", (list_id, user_id))
+    return cur.fetchone() is not None
+
+def _missing_list_items(cur, list_id, list_item_ids):
+    """The ids in `list_item_ids` that aren't items of `list_id`, sorted."""
+    wanted = set(list_item_ids)
+    if not wanted:
+        return []
+    cur.execute("SELECT list_item_id FROM grocery_list_items WHERE list_id = %s AND list_item_id = ANY(%s);",
+                (list_id, list(wanted)))
+    return sorted(wanted - {row[0] for row in cur.fetchall()})
+
+def _apply_item_delta(cur, list_id, added, updated, removed):
+    if removed:
+        cur.execute("DELETE FROM grocery_list_items WHERE list_id = %s AND list_item_id = ANY(%s);", (list_id, list(removed)))
+    now = datetime.now(timezone.utc)
+    for list_item_id, changes in updated:
+        assignments = [sql.SQL("{} = %s").format(sql.Identifier(col)) for col in changes]
+        assignments.append(sql.SQL("last_updated = %s"))
+        cur.execute(
+            sql.SQL("UPDATE grocery_list_items SET {} WHERE list_id = %s AND list_item_id = %s;").format(
+                sql.SQL(", ").join(assignments)
+            ),
+            list(changes.values()) + [now, list_id, list_item_id]
+        )
+    insert_list_items(cur, list_id, added)
+
+def update_grocery_list(list_obj, user_id, incremental=True):
+    """
+    Saves `list_obj` over the stored list. In incremental mode only the items that were
+    added, changed or removed are written; otherwise every item row is rewritten.
+    """
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                if not _lock_owned_list(cur, list_obj.list_id, user_id):
+                    return False
+
+                cur.execute("UPDATE grocery_lists SET name = %s WHERE list_id = %s;", (list_obj.name, list_obj.list_id))
+
+                if incremental:
+                    cur.execute("SELECT * FROM grocery_list_items WHERE list_id = %s ORDER BY list_item_id;", (list_obj.list_id,))
+                    added, updated, removed = diff_list_items(cur.fetchall(), list_obj.products_on_list)
+                    _apply_item_delta(cur, list_obj.list_id, added, updated, removed)
+                    summary = f"+{len(added)} ~{len(updated)} -{len(removed)}"
+                else:
+                    cur.execute("DELETE FROM grocery_list_items WHERE list_id = %s;", (list_obj.list_id,))
+                    insert_list_items(cur, list_obj.list_id, list_obj.products_on_list)
+                    summary = "full rewrite"
+
             conn.commit()
-            if cur.rowcount > 0:
-                print(f"✅ List {list_id} deleted successfully.")
-                return True
-            else:
-                print(f"⚠️ Warning: List {list_id} not found or permission denied for user {user_id}.")
-                return False
-    except psycopg2.Error as e:
-        print(f"Error removing grocery list: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
-
-def update_grocery_list(list_obj, user_id):
-    conn = get_db_connection()
-    if conn is None: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT user_id FROM grocery_lists WHERE list_id = %s AND user_id = %s;", (list_obj.list_id, user_id))
-            if cur.fetchone() is None:
-                return False
+            print(f"✅ List {list_obj.list_id} updated successfully ({summary}).")
+            return True
+        except psycopg2.Error as e:
+            print(f"Error updating grocery list: {e}")
+            conn.rollback()
+            return False
+
+def patch_grocery_list(list_id, user_id, name=None, added=None, updated=None, removed=None):
+    """
+    Applies item-level operations to a list in one transaction.
+
+    Args:
+        added: [(Product, quantity)] to insert
+        updated: [(list_item_id, {Product attribute name: value})]; unknown fields are ignored
+        removed: [list_item_id] to delete
+
+    Returns:
+        bool: False if the list doesn't exist, isn't owned by `user_id`, or the write failed
+
+    Raises:
+        LookupError: An updated or removed list_item_id isn't on the list; nothing is written
+    """
+    updated_columns = []
+    for list_item_id, fields in updated or []:
+        changes = {ITEM_UPDATABLE_FIELDS[f]: v for f, v in fields.items() if f in ITEM_UPDATABLE_FIELDS}
+        if changes:
+            updated_columns.append((list_item_id, changes))
+
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
+                if not _lock_owned_list(cur, list_id, user_id):
+                    return False
+                missing = _missing_list_items(cur, list_id, [i for i, _ in updated or []] + list(removed or []))
+                if missing:
+                    conn.rollback()
+                    raise LookupError(f"List items not found: {missing}")
+                if name is not None:
+                    cur.execute("UPDATE grocery_lists SET name = %s WHERE list_id = %s;", (name, list_id))
+                _apply_item_delta(cur, list_id, added or [], updated_columns, removed or [])
+            conn.commit()
+            print(f"✅ List {list_id} patched successfully.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Error patching grocery list: {e}")
+            conn.rollback()
+            return False
 
-            cur.execute("UPDATE grocery_lists SET name = %s WHERE list_id = %s;", (list_obj.name, list_obj.list_id))
-            
-            cur.execute("DELETE FROM grocery_list_items WHERE list_id = %s;", (list_obj.list_id,))
+def get_recommendation_set(fingerprint):
+    """Returns {'recommendations', 'computed_at'} stored for a signal fingerprint, or None."""
+    with db_connection() as conn:
+        if conn is None: return None
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute("SELECT recommendations, computed_at FROM recommendation_sets WHERE fingerprint = %s;", (fingerprint,))
+                row = cur.fetchone()
+                return dict(row) if row else None
+        except psycopg2.Error as e:
+            print(f"Error getting recommendation set: {e}")
+            return None
 
-            for product, quantity in list_obj.products_on_list:
+def save_recommendation_set(fingerprint, params, recommendations):
+    """Inserts or replaces the recommendations stored for a signal fingerprint."""
+    with db_connection() as conn:
+        if conn is None: return False
+        try:
+            with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO grocery_list_items (
-                        list_id, name, price, promo_price, fulfillment_type, brand,
-                        inventory, size, last_updated, location_id, upc, quantity, category
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-                """, (
-                    list_obj.list_id, product.name, product.price, product.promo_price,
-                    product.fulfillment_type, product.brand, product.inventory, product.size,
-                    product.last_updated, product.location_ID, product.upc, quantity, product.category
-                ))
+                    INSERT INTO recommendation_sets (fingerprint, params, recommendations, computed_at)
+                    VALUES (%s, %s, %s, now())
+                    ON CONFLICT (fingerprint) DO UPDATE SET
+                        params = EXCLUDED.params,
+                        recommendations = EXCLUDED.recommendations,
+                        computed_at = EXCLUDED.computed_at;
+                """, (fingerprint, psycopg2.extras.Json(params), psycopg2.extras.Json(recommendations)))
+            conn.commit()
+            return True
+        except psycopg2.Error as e:
+            print(f"Error saving recommendation set: {e}")
+            conn.rollback()
+            return False
 
-        conn.commit()
-        print(f"✅ List {list_obj.list_id} updated successfully.")
-        return True
-    except psycopg2.Error as e:
-        print(f"Error updating grocery list: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
\ No newline at end of file
+def get_all_profile_signals():
+    """Returns the profile columns recommendations depend on, for every user."""
+    with db_connection() as conn:
+        if conn is None: return []
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute("SELECT favorite_cuisines, dietary_restrictions, age, gender FROM users;")
+                return [dict(row) for row in cur.fetchall()]
+        except psycopg2.Error as e:
+            print(f"Error getting profile signals: {e}")
+            return []
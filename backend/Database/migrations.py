@@ -0,0 +1,162 @@
+"""
+Versioned schema migrations.
+
+Each migration is applied at most once, in version order, in its own
+transaction, and recorded in `schema_migrations`. Add new schema changes by
+appending to MIGRATIONS; never edit a migration that has already shipped.
+"""
+import psycopg2
+
+# Arbitrary key for the pg_advisory_lock that concurrently booting workers
+# hold while migrating, so they apply migrations one at a time.
+MIGRATION_LOCK_KEY = 814_221_001
+
+MIGRATIONS = [
+    (1, "baseline tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            access_token TEXT,
+            refresh_token TEXT,
+            token_type TEXT,
+            token_expiry TIMESTAMP WITH TIME ZONE,
+            list_of_list_ids JSONB DEFAULT '[]'::jsonb,
+            first_name TEXT,
+            last_name TEXT,
+            preferred_location TEXT,
+            budget INTEGER,
+            shopping_frequency TEXT,
+            shopping_priority TEXT,
+            dietary_restrictions JSONB,
+            allergies JSONB,
+            health_goals TEXT,
+            favorite_cuisines JSONB,
+            cultural_background TEXT,
+            favorite_foods TEXT,
+            age INTEGER,
+            gender TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS grocery_lists (
+            list_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            name TEXT NOT NULL DEFAULT 'My Grocery List',
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS grocery_list_items (
+            list_item_id SERIAL PRIMARY KEY,
+            list_id TEXT NOT NULL REFERENCES grocery_lists(list_id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            price NUMERIC(10, 2),
+            promo_price NUMERIC(10, 2),
+            fulfillment_type TEXT,
+            brand TEXT,
+            inventory TEXT,
+            size TEXT,
+            last_updated TIMESTAMP WITH TIME ZONE,
+            location_id TEXT,
+            upc TEXT,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            category TEXT
+        );
+        """,
+    ]),
+    (2, "indexes for list reads and price refresh", [
+        # get_all_lists_for_user / get_lists_page_for_user: filter by user, newest first,
+        # with list_id as the keyset tie-breaker.
+        """
+        CREATE INDEX IF NOT EXISTS idx_grocery_lists_user_timestamp
+            ON grocery_lists (user_id, timestamp DESC, list_id DESC);
+        """,
+        # Item loads and diffs for one list, in insertion order.
+        """
+        CREATE INDEX IF NOT EXISTS idx_grocery_list_items_list
+            ON grocery_list_items (list_id, list_item_id);
+        """,
+        # Price-refresh jobs look items up by product.
+        """
+        CREATE INDEX IF NOT EXISTS idx_grocery_list_items_upc
+            ON grocery_list_items (upc);
+        """,
+    ]),
+    (3, "precomputed recommendation sets", [
+        # Qloo recommendations keyed by a fingerprint of the canonical insights params.
+        """
+        CREATE TABLE IF NOT EXISTS recommendation_sets (
+            fingerprint TEXT PRIMARY KEY,
+            params JSONB NOT NULL,
+            recommendations JSONB NOT NULL,
+            computed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        );
+        """,
+    ]),
+]
+
+def _ensure_migrations_table(conn):
+    # Only called with the migration lock held: concurrent CREATE TABLE IF NOT
+    # EXISTS can still collide on the catalog's unique indexes.
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            );
+        """)
+    conn.commit()
+
+def _apply_pending(conn):
+    _ensure_migrations_table(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations;")
+        done = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    applied = []
+    for version, description, statements in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in done:
+            continue
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                (version, description)
+            )
+        conn.commit()
+        applied.append(version)
+        print(f"✅ Applied migration {version}: {description}")
+    return applied
+
+def apply_migrations(conn):
+    """
+    Applies every pending migration on `conn`, each in its own transaction.
+
+    A session-level advisory lock is held for the whole run, from creating
+    `schema_migrations` onwards, so a worker that waited on it sees the
+    migrations the previous holder applied and skips them.
+
+    Returns:
+        list: Versions applied by this call (empty if the schema was already current)
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    try:
+        return _apply_pending(conn)
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+        except psycopg2.Error:
+            # A dropped connection releases its session locks with it
+            pass
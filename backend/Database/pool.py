@@ -0,0 +1,157 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of PostgreSQL connections.
+
+    Connections are opened lazily up to `maxconn`, checked for health when
+    they are handed out, and returned to the pool instead of being closed.
+    Callers that find the pool exhausted wait up to `timeout` seconds for a
+    connection to be released.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=10.0, healthcheck_idle=30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._connect_kwargs = connect_kwargs
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "timeouts": 0,
+            "connect_errors": 0,
+            "healthcheck_failures": 0,
+            "discarded": 0,
+        }
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = psycopg2.pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, **self._connect_kwargs
+                    )
+        return self._pool
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _is_healthy(self, conn):
+        """Cheap checks first; only ping connections that have sat idle for a while."""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        pool = self._get_pool()
+        # A handful of attempts covers the case where several pooled
+        # connections went stale at once (e.g. after a database restart).
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._bump("healthcheck_failures")
+            self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy connection from the pool")
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._bump("discarded")
+        try:
+            self._get_pool().putconn(conn, close=True)
+        except psycopg2.pool.PoolError:
+            pass
+
+    def _release(self, conn):
+        broken = conn.closed
+        if not broken and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Anything the caller didn't commit is rolled back before reuse.
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            self._discard(conn)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+            self._get_pool().putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a `with` block.
+
+        Yields None if no connection could be obtained, mirroring the old
+        get_db_connection() contract so callers can bail out early.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            self._bump("timeouts")
+            print(f"Error connecting to database: pool exhausted after {self.timeout}s")
+            yield None
+            return
+        try:
+            conn = self._checkout()
+        except psycopg2.Error as e:
+            self._slots.release()
+            self._bump("connect_errors")
+            print(f"Error connecting to database: {e}")
+            yield None
+            return
+
+        self._bump("checkouts")
+        self._bump("in_use")
+        try:
+            yield conn
+        finally:
+            self._bump("in_use", -1)
+            try:
+                self._release(conn)
+            finally:
+                self._slots.release()
+
+    def stats(self):
+        """Snapshot of pool counters for health checks and monitoring."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        pool = self._pool
+        snapshot["min_size"] = self.minconn
+        snapshot["max_size"] = self.maxconn
+        if pool is not None and not pool.closed:
+            snapshot["open"] = len(pool._pool) + len(pool._used)
+            snapshot["idle"] = len(pool._pool)
+        else:
+            snapshot["open"] = 0
+            snapshot["idle"] = 0
+        return snapshot
+
+    def close(self):
+        with self._init_lock:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.closeall()
+            self._pool = None
+            self._last_used.clear()
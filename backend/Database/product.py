@@ -1,6 +1,12 @@
 import datetime
 
 class Product:
+    # Search results create thousands of these per second; slots drop the per-instance __dict__.
+    __slots__ = (
+        "name", "price", "promo_price", "fulfillment_type", "brand", "inventory",
+        "size", "last_updated", "location_ID", "upc", "category"
+    )
+
     def __init__(self, name, price, promo_price, fulfillment_type, brand, inventory, size, last_updated, location_ID, upc, category="Uncategorized"):
         self.name = name
         self.price = price
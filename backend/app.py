@@ -29,23 +29,20 @@ class GroceryOptimizationApp:
         
     def find_user_by_email(self, email):
         """Check if user exists by email."""
-        conn = db_utils.get_db_connection()
-        if conn is None:
-            return None
-            
         try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT user_id FROM users WHERE email = %s;", (email,))
-                result = cur.fetchone()
-                if result:
-                    user_id = result[0]
-                    return db_utils.get_user_by_id(user_id)
-                return None
+            with db_utils.db_connection() as conn:
+                if conn is None:
+                    return None
+                with conn.cursor() as cur:
+                    cur.execute("SELECT user_id FROM users WHERE email = %s;", (email,))
+                    result = cur.fetchone()
+            if result:
+                user_id = result[0]
+                return db_utils.get_user_by_id(user_id)
+            return None
         except Exception as e:
             print(f"Error finding user by email: {e}")
             return None
-        finally:
-            conn.close()
     
     def create_new_user(self, email, password):
         """Create a new user with unique ID."""
@@ -125,6 +122,14 @@ class GroceryOptimizationApp:
             print(f"Error searching for products: {e}")
             return []
     
+    def search_product_dicts(self, search_term, limit=5):
+        """Search for products, returning serialized dicts without building Product objects."""
+        try:
+            return self.kroger_api.productSearchDicts(search_term, limit=limit)
+        except Exception as e:
+            print(f"Error searching for products: {e}")
+            return []
+    
     def add_product_to_list(self, grocery_list, product, quantity=1):
         """Add a product to grocery list."""
         grocery_list.products_on_list.append((product, quantity))
@@ -150,23 +155,31 @@ grocery_app = GroceryOptimizationApp()
 def init_database():
     """Initialize database tables if they don't exist."""
     try:
-        conn = db_utils.get_db_connection()
-        if conn:
-            conn.close()
-            print("✅ Database connection verified")
-        else:
-            print("❌ Database connection failed")
+        with db_utils.db_connection() as conn:
+            if conn:
+                print("✅ Database connection verified")
+            else:
+                print("❌ Database connection failed")
+                return
+        db_utils.create_tables()
     except Exception as e:
         print(f"Database initialization error: {e}")
 
+# Run on import, so workers started by a WSGI server get the current schema too
+init_database()
+
 # API Routes
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
+    with db_utils.db_connection() as conn:
+        database_status = 'connected' if conn else 'disconnected'
     return jsonify({
         'status': 'healthy',
-        'database': 'connected' if db_utils.get_db_connection() else 'disconnected',
-        'kroger_api': 'connected' if grocery_app.kroger_api._service_token else 'disconnected'
+        'database': database_status,
+        'db_pool': db_utils.pool_stats(),
+        'kroger_api': 'connected' if grocery_app.kroger_api._service_token else 'disconnected',
+        'kroger_cache': grocery_app.kroger_api.cache_stats()
     })
 
 @app.route('/api/auth/login', methods=['POST'])
@@ -209,21 +222,21 @@ def search_products():
         if not search_term:
             return jsonify({'error': 'Search query is required'}), 400
         
-        products = grocery_app.search_products(search_term, limit=limit)
+        products = grocery_app.search_product_dicts(search_term, limit=limit)
         
-        # Convert products to JSON-serializable format
+        # Reshape to this endpoint's JSON format
         product_list = []
         for product in products:
             product_list.append({
-                'name': product.name,
-                'price': float(product.price) if product.price else None,
-                'promo_price': float(product.promo_price) if product.promo_price else None,
-                'brand': product.brand,
-                'upc': product.upc,
-                'size': product.size,
-                'inventory': product.inventory,
-                'fulfillment_type': product.fufillment_type,
-                'location_id': product.location_ID
+                'name': product['name'],
+                'price': product['price'] or None,
+                'promo_price': product['promo_price'] or None,
+                'brand': product['brand'],
+                'upc': product['upc'],
+                'size': product['size'],
+                'inventory': product['inventory'],
+                'fulfillment_type': product['fulfillment_type'],
+                'location_id': product['location_ID']
             })
         
         return jsonify({
@@ -374,9 +387,6 @@ if __name__ == '__main__':
     print("🚀 Starting Grocery Optimization Platform (Merged)")
     print("=" * 50)
     
-    # Initialize database
-    init_database()
-    
     # Initialize Kroger API
     if grocery_app.kroger_api._service_token:
         print("✅ Kroger API initialized")
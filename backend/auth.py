@@ -3,6 +3,7 @@ import sys
 import uuid
 import jwt
 import json
+import math
 from datetime import datetime, timezone, timedelta
 from flask import Flask, redirect, url_for, request, jsonify
 from authlib.integrations.flask_client import OAuth
@@ -17,20 +18,18 @@ from Database import db_utils
 from Database.user import User
 from Database.list import GroceryList
 from Database.product import Product
-from kroger import KrogerAPI
+from kroger import KrogerAPI, KrogerAPIError
+import recommendations
 
 # --- User Management Logic ---
 class AuthUserService:
     def find_user_by_email(self, email):
-        conn = db_utils.get_db_connection()
-        if conn is None: return None
-        try:
+        with db_utils.db_connection() as conn:
+            if conn is None: return None
             with conn.cursor() as cur:
                 cur.execute("SELECT user_id FROM users WHERE email = %s;", (email,))
                 result = cur.fetchone()
-                return db_utils.get_user_by_id(result[0]) if result else None
-        finally:
-            conn.close()
+        return db_utils.get_user_by_id(result[0]) if result else None
 
     def create_new_user(self, email):
         user_id = str(uuid.uuid4())
@@ -45,6 +44,8 @@ CORS(app, supports_credentials=True)
 oauth = OAuth(app)
 user_service = AuthUserService()
 kroger_api = KrogerAPI()
+# Migrate on import, so workers started by a WSGI server get the current schema too
+db_utils.create_tables()
 
 oauth.register(
     name='google',
@@ -54,6 +55,78 @@ oauth.register(
     client_kwargs={'scope': 'openid email profile'}
 )
 
+def product_from_item(item):
+    """Builds a Product from a list item sent by the frontend, filling in defaults."""
+    return Product(
+        name=item.get('name'),
+        price=item.get('price', 0.00),
+        promo_price=item.get('promo_price'),
+        fulfillment_type=item.get('fulfillment_type', 'UNKNOWN'),
+        brand=item.get('brand', 'N/A'),
+        inventory=item.get('inventory', 'UNKNOWN'),
+        size=item.get('size', 'N/A'),
+        last_updated=datetime.now(timezone.utc),
+        # Items read back from /api/grocery-lists carry the column name `location_id`.
+        location_ID=item.get('location_ID', item.get('location_id', 'N/A')),
+        upc=item.get('upc', 'N/A'),
+        category=item.get('category', 'Uncategorized')
+    )
+
+# Limits of the item columns: INTEGER (int4) ids and quantities, NUMERIC(10, 2) prices
+INT4_MAX = 2**31 - 1
+PRICE_LIMIT = 10**8
+ITEM_TEXT_FIELDS = ('fulfillment_type', 'brand', 'inventory', 'size', 'location_ID', 'location_id', 'upc', 'category')
+
+def _is_int(value):
+    # bool is an int subclass, but true/false are not ids or quantities
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _item_field_error(field, value):
+    """Why `value` can't be stored in item column `field`, or None if it can."""
+    if field == 'quantity' and not (_is_int(value) and 0 < value <= INT4_MAX):
+        return f"quantity must be an integer between 1 and {INT4_MAX}"
+    if field == 'name' and not (isinstance(value, str) and value.strip()):
+        return "name must be a non-empty string"
+    if field in ('price', 'promo_price') and value is not None and \
+            (isinstance(value, bool) or not isinstance(value, (int, float))
+             or not math.isfinite(value) or abs(value) >= PRICE_LIMIT):
+        return f"{field} must be a finite number below {PRICE_LIMIT} in magnitude"
+    if field in ITEM_TEXT_FIELDS and value is not None and not isinstance(value, str):
+        return f"{field} must be a string"
+    return None
+
+def _patch_operation_error(operation):
+    """Validates one PATCH /api/grocery-list operation; returns an error message or None."""
+    if not isinstance(operation, dict):
+        return "operation must be an object"
+    op = operation.get('op')
+    if op == 'add':
+        item = operation.get('item')
+        if not isinstance(item, dict):
+            return "item must be an object"
+        for field in ('name', 'price', 'promo_price') + ITEM_TEXT_FIELDS:
+            error = _item_field_error(field, item.get(field))
+            if error:
+                return error
+        if 'quantity' in item:
+            return _item_field_error('quantity', item['quantity'])
+        return None
+    if op in ('update', 'remove'):
+        list_item_id = operation.get('list_item_id')
+        if not (_is_int(list_item_id) and 0 < list_item_id <= INT4_MAX):
+            return f"list_item_id must be an integer between 1 and {INT4_MAX}"
+        if op == 'remove':
+            return None
+        fields = operation.get('fields', {})
+        if not isinstance(fields, dict):
+            return "fields must be an object"
+        for field, value in fields.items():
+            error = _item_field_error(field, value)
+            if error:
+                return error
+        return None
+    return "op must be 'add', 'update' or 'remove'"
+
 # --- JWT Verification Decorator ---
 def token_required(f):
     @wraps(f)
@@ -65,7 +138,7 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
         try:
             data = jwt.decode(token, os.getenv("JWT_SECRET"), algorithms=["HS256"])
-            current_user = db_utils.get_user_by_id(data['id'])
+            current_user = db_utils.get_cached_user(data['id'])
             if not current_user:
                  return jsonify({'message': 'User not found!'}), 404
         except Exception:
@@ -74,6 +147,10 @@ def token_required(f):
     return decorated
 
 # --- API Routes ---
+@app.route('/api/health/db')
+def db_health():
+    return jsonify({"pool": db_utils.pool_stats(), "user_cache": db_utils.user_cache_stats()})
+
 @app.route('/api/products/search', methods=['POST'])
 @token_required
 def search_kroger_products(current_user):
@@ -84,9 +161,7 @@ def search_kroger_products(current_user):
 
     zip_code = current_user.preferred_location or "98075" 
     
-    products = kroger_api.productSearch(search_term, limit=3, zip_code=zip_code)
-    
-    product_dicts = [p.to_dict() for p in products]
+    product_dicts = kroger_api.productSearchDicts(search_term, limit=3, zip_code=zip_code)
     
     return jsonify(product_dicts)
 
@@ -108,6 +183,13 @@ def get_user_profile(current_user):
     }
     return jsonify(user_data)
 
+@app.route('/api/recommendations')
+@token_required
+def get_recommendations(current_user):
+    # Served from the precomputed store; never waits on Qloo.
+    result = recommendations.get_recommendations(recommendations.user_profile_from_user(current_user))
+    return jsonify(result)
+
 @app.route('/api/user/finalize-profile', methods=['POST'])
 @token_required
 def finalize_profile(current_user):
@@ -129,6 +211,8 @@ def finalize_profile(current_user):
     current_user.age = profile_data.get('age')
     current_user.gender = profile_data.get('gender')
     if db_utils.update_user_details(current_user):
+        # New signals mean a new fingerprint; start computing it before the dashboard asks.
+        recommendations.warm_recommendations(recommendations.user_profile_from_user(current_user))
         return jsonify({"message": "Profile updated successfully"}), 200
     else:
         return jsonify({"error": "Failed to update profile"}), 500
@@ -154,6 +238,8 @@ def update_profile(current_user):
     current_user.age = profile_data.get('age', current_user.age)
     current_user.gender = profile_data.get('gender', current_user.gender)
     if db_utils.update_user_details(current_user):
+        # New signals mean a new fingerprint; start computing it before the dashboard asks.
+        recommendations.warm_recommendations(recommendations.user_profile_from_user(current_user))
         return jsonify({"message": "Profile updated successfully"}), 200
     else:
         return jsonify({"error": "Failed to update profile in database"}), 500
@@ -168,19 +254,7 @@ def create_grocery_list(current_user):
         return jsonify({"error": "List name and items are required"}), 400
     products_on_list = []
     for item in items_data:
-        product = Product(
-            name=item.get('name'),
-            price=item.get('price', 0.00),
-            promo_price=item.get('promo_price'),
-            fulfillment_type=item.get('fulfillment_type', 'UNKNOWN'),
-            brand=item.get('brand', 'N/A'),
-            inventory=item.get('inventory', 'UNKNOWN'),
-            size=item.get('size', 'N/A'),
-            last_updated=datetime.now(timezone.utc),
-            location_ID=item.get('location_ID', 'N/A'),
-            upc=item.get('upc', 'N/A'),
-            category=item.get('category', 'Uncategorized')
-        )
+        product = product_from_item(item)
         quantity = item.get('quantity', 1)
         products_on_list.append((product, quantity))
     new_list = GroceryList(
@@ -203,19 +277,7 @@ def update_grocery_list_endpoint(current_user, list_id):
     list_name = data.get('name', 'My Grocery List')
     products_on_list = []
     for item in items_data:
-        product = Product(
-            name=item.get('name'),
-            price=item.get('price', 0.00),
-            promo_price=item.get('promo_price'),
-            fulfillment_type=item.get('fulfillment_type', 'UNKNOWN'),
-            brand=item.get('brand', 'N/A'),
-            inventory=item.get('inventory', 'UNKNOWN'),
-            size=item.get('size', 'N/A'),
-            last_updated=datetime.now(timezone.utc),
-            location_ID=item.get('location_ID', 'N/A'),
-            upc=item.get('upc', 'N/A'),
-            category=item.get('category', 'Uncategorized')
-        )
+        product = product_from_item(item)
         quantity = item.get('quantity', 1)
         products_on_list.append((product, quantity))
     list_to_update = GroceryList(
@@ -230,6 +292,71 @@ def update_grocery_list_endpoint(current_user, list_id):
     else:
         return jsonify({"error": "Failed to update list or permission denied"}), 404
 
+@app.route('/api/grocery-list/<string:list_id>', methods=['PATCH'])
+@token_required
+def patch_grocery_list_endpoint(current_user, list_id):
+    """
+    Applies item-level operations without resending the whole list:
+        {"name": "...", "operations": [
+            {"op": "add", "item": {...}},
+            {"op": "update", "list_item_id": 12, "fields": {"quantity": 3}},
+            {"op": "remove", "list_item_id": 12}
+        ]}
+    Malformed input is a 400, an unknown list a 404, and a list_item_id that isn't
+    on the list a 409; in every case nothing is written.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    operations = data.get('operations', [])
+    if not isinstance(operations, list):
+        return jsonify({"error": "operations must be a list"}), 400
+    name = data.get('name')
+    if name is not None and not (isinstance(name, str) and name.strip()):
+        return jsonify({"error": "name must be a non-empty string"}), 400
+    added, updated, removed = [], [], []
+    for operation in operations:
+        error = _patch_operation_error(operation)
+        if error:
+            return jsonify({"error": f"Invalid operation {operation}: {error}"}), 400
+        op = operation['op']
+        if op == 'add':
+            item = operation['item']
+            added.append((product_from_item(item), item.get('quantity', 1)))
+        elif op == 'update':
+            updated.append((operation['list_item_id'], operation.get('fields', {})))
+        else:
+            removed.append(operation['list_item_id'])
+    try:
+        patched = db_utils.patch_grocery_list(list_id, current_user.user_id, name=name,
+                                              added=added, updated=updated, removed=removed)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 409
+    if patched:
+        return jsonify({"message": "List updated successfully"}), 200
+    else:
+        return jsonify({"error": "Failed to update list or permission denied"}), 404
+
+@app.route('/api/grocery-list/<string:list_id>/cart', methods=['POST'])
+@token_required
+def send_grocery_list_to_cart(current_user, list_id):
+    """Adds every item on the list to the user's Kroger cart; needs a connected Kroger account (/api/kroger/connect)."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    modality = data.get('modality', 'PICKUP')
+    if modality not in ('PICKUP', 'DELIVERY'):
+        return jsonify({"error": "modality must be PICKUP or DELIVERY"}), 400
+    grocery_list = db_utils.get_grocery_list(list_id, current_user.user_id)
+    if not grocery_list:
+        return jsonify({"error": "List not found or permission denied"}), 404
+    try:
+        results = kroger_api.addListToCart(grocery_list, modality=modality, user_id=current_user.user_id)
+    except KrogerAPIError as e:
+        return jsonify({"error": str(e)}), 401
+    added = sum(1 for r in results if r['success'])
+    return jsonify({"added": added, "failed": len(results) - added, "results": results}), 200
+
 @app.route('/api/grocery-list/<string:list_id>', methods=['DELETE'])
 @token_required
 def delete_grocery_list(current_user, list_id):
@@ -241,8 +368,22 @@ def delete_grocery_list(current_user, list_id):
 @app.route('/api/grocery-lists', methods=['GET'])
 @token_required
 def get_grocery_lists(current_user):
-    user_lists = db_utils.get_all_lists_for_user(current_user.user_id)
-    return jsonify(user_lists)
+    if 'limit' not in request.args:
+        user_lists = db_utils.get_all_lists_for_user(current_user.user_id)
+        return jsonify(user_lists)
+    # Paginated mode: the body stays a plain array, the next page is signalled via header.
+    limit = request.args.get('limit', type=int)
+    if limit is None or limit <= 0:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    cursor = request.args.get('cursor')
+    try:
+        user_lists, next_cursor = db_utils.get_lists_page_for_user(current_user.user_id, limit=limit, cursor=cursor)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    response = jsonify(user_lists)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 # --- SIGN UP FLOW ---
 @app.route('/auth/google/signup')
@@ -289,8 +430,36 @@ def auth_google_login_callback():
         print(f"Login callback error: {e}")
         return redirect(f"{os.getenv('FRONTEND_URL')}/login?error=true")
 
+# --- KROGER CART AUTHORIZATION FLOW ---
+# KROGER_REDIRECT_URI must point at /auth/kroger/callback. The OAuth `state` is a
+# short-lived JWT naming the user, so the callback knows whose tokens it received.
+KROGER_STATE_TTL = timedelta(minutes=10)
+
+@app.route('/api/kroger/connect')
+@token_required
+def connect_kroger(current_user):
+    """Returns the Kroger authorization URL the frontend should send the user to."""
+    state = jwt.encode(
+        {'id': current_user.user_id, 'purpose': 'kroger_connect', 'exp': datetime.now(timezone.utc) + KROGER_STATE_TTL},
+        os.getenv("JWT_SECRET"), algorithm='HS256'
+    )
+    return jsonify({"url": kroger_api.getAuthorizationUrl(state=state)})
+
+@app.route('/auth/kroger/callback')
+def auth_kroger_callback():
+    try:
+        state = jwt.decode(request.args.get('state', ''), os.getenv("JWT_SECRET"), algorithms=["HS256"])
+        if state.get('purpose') != 'kroger_connect':
+            raise jwt.InvalidTokenError("Wrong state purpose")
+    except jwt.InvalidTokenError as e:
+        print(f"Kroger callback error: {e}")
+        return redirect(f"{os.getenv('FRONTEND_URL')}/dashboard?kroger=error")
+    code = request.args.get('code')
+    if not code or not kroger_api.exchangeAuthCode(code, user_id=state['id']):
+        return redirect(f"{os.getenv('FRONTEND_URL')}/dashboard?kroger=error")
+    return redirect(f"{os.getenv('FRONTEND_URL')}/dashboard?kroger=connected")
+
 # --- Main Execution Block ---
 if __name__ == '__main__':
     print("🚀 Starting Standalone Authentication Server")
-    db_utils.create_tables()
     app.run(host='0.0.0.0', port=8001, debug=True)
\ No newline at end of file
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: parsing a Kroger /v1/products payload into the JSON response shape.
+
+Compares
+  - before:  the original per-product parse (dict-backed Product, one datetime.now()
+             per product) followed by to_dict()
+  - objects: kroger.parse_products (slotted Product, one timestamp per response)
+             followed by to_dict()
+  - dicts:   kroger.parse_product_dicts, straight to the response shape
+
+Run from backend/:
+    python bench_product_parse.py
+"""
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from kroger import parse_products, parse_product_dicts
+
+PRODUCTS_PER_PAYLOAD = 50
+ROUNDS = 2000
+
+def make_payload(n):
+    return {"data": [
+        {
+            "productId": f"{i:013d}",
+            "upc": f"{i:013d}",
+            "brand": "Kroger",
+            "description": f"Kroger 2% Reduced Fat Milk {i}",
+            "items": [{
+                "itemId": f"{i:013d}",
+                "price": {"regular": 3.49, "promo": 2.99 if i % 3 == 0 else 0},
+                "fulfillment": {"curbside": True, "delivery": True, "instore": True, "shiptohome": False},
+                "inventory": {"stockLevel": "HIGH"},
+                "size": "1 gal"
+            }]
+        }
+        for i in range(n)
+    ]}
+
+class LegacyProduct:
+    """The pre-slots Product, kept here as the baseline."""
+
+    def __init__(self, name, price, promo_price, fulfillment_type, brand, inventory, size, last_updated, location_ID, upc, category="Uncategorized"):
+        self.name = name
+        self.price = price
+        self.promo_price = promo_price
+        self.fulfillment_type = fulfillment_type
+        self.brand = brand
+        self.inventory = inventory
+        self.size = size
+        self.last_updated = last_updated
+        self.location_ID = location_ID
+        self.upc = upc
+        self.category = category
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "price": float(self.price) if self.price is not None else 0.00,
+            "promo_price": float(self.promo_price) if self.promo_price is not None else None,
+            "fulfillment_type": self.fulfillment_type,
+            "brand": self.brand,
+            "inventory": self.inventory,
+            "size": self.size,
+            "last_updated": self.last_updated.isoformat() if self.last_updated else None,
+            "location_ID": self.location_ID,
+            "upc": self.upc,
+            "category": self.category
+        }
+
+def legacy_parse(products, location_id):
+    """The original productSearch loop body."""
+    product_objects = []
+    for product in products.get("data", []):
+        name = product.get("description", "Unknown Product")
+        brand = product.get("brand", "Unknown Brand")
+        upc = product.get("upc", "N/A")
+        items = product.get("items", [])
+        regular_price = None
+        promo_price = None
+        stock_level = "UNKNOWN"
+        fulfillment_type = "UNKNOWN"
+        size = None
+        if items:
+            item = items[0]
+            price_info = item.get("price", {})
+            if price_info:
+                regular_price = price_info.get("regular")
+                promo_price = price_info.get("promo")
+            fulfillment = item.get("fulfillment", {})
+            if fulfillment.get('instore', False):
+                fulfillment_type = "INSTORE"
+            elif fulfillment.get('delivery', False):
+                fulfillment_type = "DELIVERY"
+            elif fulfillment.get('pickup', False):
+                fulfillment_type = "PICKUP"
+            inventory_info = item.get("inventory", {})
+            stock_level = inventory_info.get("stockLevel", "UNKNOWN")
+            size = item.get("size", "N/A")
+            if size == "N/A":
+                size = None
+        product_objects.append(LegacyProduct(
+            name=name, price=regular_price, promo_price=promo_price, fulfillment_type=fulfillment_type,
+            brand=brand, inventory=stock_level, size=size, last_updated=datetime.now(),
+            location_ID=location_id, upc=upc
+        ))
+    return product_objects
+
+# label -> (parse, serialize)
+CASES = {
+    "before": (legacy_parse, lambda parsed: [p.to_dict() for p in parsed]),
+    "objects": (parse_products, lambda parsed: [p.to_dict() for p in parsed]),
+    "dicts": (parse_product_dicts, lambda parsed: parsed),
+}
+
+def measure_allocations(parse, payload):
+    """Peak bytes allocated per product while parsing, and bytes held by the parsed result."""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    parsed = parse(payload, "70100000")
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del parsed
+    return (peak - before) / PRODUCTS_PER_PAYLOAD, (current - before) / PRODUCTS_PER_PAYLOAD
+
+def run_benchmark():
+    payload = make_payload(PRODUCTS_PER_PAYLOAD)
+    print(f"{PRODUCTS_PER_PAYLOAD} products/payload, {ROUNDS} rounds")
+    print(f"{'path':>8} | {'us/product':>10} | {'peak B/product':>14} | {'held B/product':>14}")
+    print("-" * 56)
+    for label, (parse, serialize) in CASES.items():
+        seconds = min(timeit.repeat(lambda: serialize(parse(payload, "70100000")), number=ROUNDS, repeat=3))
+        per_product_us = seconds / (ROUNDS * PRODUCTS_PER_PAYLOAD) * 1e6
+        peak, held = measure_allocations(parse, payload)
+        print(f"{label:>8} | {per_product_us:>10.2f} | {peak:>14.0f} | {held:>14.0f}")
+
+if __name__ == "__main__":
+    run_benchmark()
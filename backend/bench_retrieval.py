@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: smart-swap retrieval throughput, in queries/sec.
+
+For the configured embedding backend (EMBEDDING_BACKEND / EMBEDDING_MODEL),
+measures against a throwaway in-memory collection of synthetic grocery docs:
+  - ingest:   documents embedded per second at upsert time (batched)
+  - embed:    query embeddings per second, cache bypassed
+  - cold:     embed + collection.query per second, every query distinct
+  - warm:     embed + collection.query per second, queries repeating (LRU hits)
+
+Run from backend/:
+    python bench_retrieval.py
+    EMBEDDING_BACKEND=sentence-transformers EMBEDDING_MODEL=BAAI/bge-small-en-v1.5 python bench_retrieval.py
+"""
+import time
+
+import chromadb
+
+from embeddings import CachedQueryEmbedder, get_embedding_backend
+from gemini import QUERY_TEMPLATE, deterministic_id
+
+DOCUMENTS = 2000
+QUERIES = 300
+DISTINCT_WARM_QUERIES = 20
+N_RESULTS = 3
+
+FOODS = ["apple", "orange", "tangerine", "kale", "spinach", "tofu", "salmon", "rice", "pasta", "yogurt",
+         "cheddar", "almond", "oat", "lentil", "basil", "mango", "pepper", "bread", "honey", "miso"]
+STYLES = ["organic", "smoked", "roasted", "fresh", "dried", "spicy", "sweet", "aged", "whole", "frozen"]
+
+def make_documents(n):
+    docs = []
+    for i in range(n):
+        food = FOODS[i % len(FOODS)]
+        style = STYLES[(i // len(FOODS)) % len(STYLES)]
+        name = f"{style.title()} {food} {i}"
+        docs.append(f"{name}: {style} {food}, popular in home cooking and snacks")
+    return docs
+
+def rate(count, seconds):
+    return count / seconds if seconds else float("inf")
+
+def run_benchmark():
+    backend = get_embedding_backend()
+    embedder = CachedQueryEmbedder(backend)
+    collection = chromadb.Client().get_or_create_collection(name="bench_retrieval")
+
+    # Load the model outside the timings
+    backend.embed_query("warmup")
+
+    docs = make_documents(DOCUMENTS)
+    start = time.perf_counter()
+    for i in range(0, len(docs), backend.batch_size):
+        batch = docs[i:i + backend.batch_size]
+        collection.upsert(
+            ids=[deterministic_id(d.split(":", 1)[0]) for d in batch],
+            embeddings=backend.embed_documents(batch),
+            documents=batch,
+        )
+    ingest = rate(len(docs), time.perf_counter() - start)
+
+    cold_queries = [QUERY_TEMPLATE.format(query=f"{FOODS[i % len(FOODS)]} {i}") for i in range(QUERIES)]
+    warm_queries = [cold_queries[i % DISTINCT_WARM_QUERIES] for i in range(QUERIES)]
+
+    start = time.perf_counter()
+    for q in cold_queries:
+        backend.embed_query(q)
+    embed = rate(QUERIES, time.perf_counter() - start)
+
+    def timed_queries(queries):
+        start = time.perf_counter()
+        for q in queries:
+            collection.query(query_embeddings=[embedder.embed_query(q)], n_results=N_RESULTS)
+        return rate(len(queries), time.perf_counter() - start)
+
+    cold = timed_queries(cold_queries)
+    warm = timed_queries(warm_queries)
+
+    print(f"backend {backend.name}, {DOCUMENTS} docs, {QUERIES} queries, n_results={N_RESULTS}")
+    print(f"{'path':>7} | {'per sec':>10}")
+    print("-" * 21)
+    for label, value in (("ingest", ingest), ("embed", embed), ("cold", cold), ("warm", warm)):
+        print(f"{label:>7} | {value:>10.1f}")
+    print(f"query cache: {embedder.stats()}")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,141 @@
+"""
+Embedding backends for the smart-swap retrieval collection.
+
+gemini.py embeds documents and queries itself (rather than leaving it to the
+collection's embedding function) so the model is configurable, documents are
+embedded in batches at upsert time, and repeated queries hit an LRU cache.
+
+    EMBEDDING_BACKEND=chroma                 Chroma's bundled ONNX all-MiniLM-L6-v2 (default)
+    EMBEDDING_BACKEND=sentence-transformers  Any local sentence-transformers model, set by
+                                             EMBEDDING_MODEL (needs `pip install sentence-transformers`)
+"""
+import hashlib
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+
+from cache import TTLCache
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "chroma")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE") or None
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "4096"))
+EMBEDDING_QUERY_CACHE_TTL = float(os.getenv("EMBEDDING_QUERY_CACHE_TTL", 24 * 3600))
+
+class EmbeddingBackend(ABC):
+    """Turns texts into vectors. Subclasses load their model on first use."""
+
+    # Identifies the vector space; collections are kept per name so models never mix
+    name = "base"
+
+    def __init__(self, batch_size=EMBEDDING_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _embed(self, texts):
+        """Embeds one batch of texts; returns a sequence of vectors."""
+
+    def embed_documents(self, texts):
+        """Embeds `texts` in batches of `batch_size`; returns one list of floats per text."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed(texts[start:start + self.batch_size]))
+        return [[float(x) for x in vector] for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class ChromaDefaultBackend(EmbeddingBackend):
+    """Chroma's default embedding function, the model the collection used before backends were pluggable."""
+
+    name = "chroma-default"
+
+    def __init__(self, batch_size=EMBEDDING_BATCH_SIZE):
+        super().__init__(batch_size)
+        self._function = None
+
+    def _embed(self, texts):
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    from chromadb.utils import embedding_functions
+                    self._function = embedding_functions.DefaultEmbeddingFunction()
+        return self._function(texts)
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """A local sentence-transformers model, e.g. all-MiniLM-L6-v2 or bge-small-en-v1.5."""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, device=EMBEDDING_DEVICE, batch_size=EMBEDDING_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.model_name = model_name
+        self.device = device
+        self.name = f"st-{model_name}"
+        self._model = None
+
+    def _embed(self, texts):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+
+    def embed_documents(self, texts):
+        # encode() batches internally; one call avoids re-entering the model per chunk
+        if not texts:
+            return []
+        return [[float(x) for x in vector] for vector in self._embed(texts)]
+
+class CachedQueryEmbedder:
+    """Wraps a backend with an LRU cache of query embeddings; documents pass straight through."""
+
+    def __init__(self, backend, maxsize=EMBEDDING_QUERY_CACHE_SIZE, ttl=EMBEDDING_QUERY_CACHE_TTL):
+        self.backend = backend
+        self._queries = TTLCache(maxsize=maxsize, ttl=ttl, name="query_embeddings")
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def embed_documents(self, texts):
+        return self.backend.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = text.strip()
+        vector = self._queries.get(key)
+        if vector is None:
+            vector = self.backend.embed_query(key)
+            self._queries.set(key, vector)
+        return vector
+
+    def stats(self):
+        return self._queries.stats()
+
+# Chroma caps collection names at 63 characters; this leaves room for the base name
+COLLECTION_SUFFIX_MAX = 40
+
+def collection_suffix(backend):
+    """
+    '' for the default backend (keeps the existing collection), else a name-safe
+    slug of the model. Slugs too long for a collection name are truncated and end
+    in a short hash of the full backend name, so distinct models stay distinct.
+    """
+    if backend.name == ChromaDefaultBackend.name:
+        return ""
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", backend.name).strip("-_")
+    if len(slug) + 2 > COLLECTION_SUFFIX_MAX:
+        digest = hashlib.sha256(backend.name.encode("utf-8")).hexdigest()[:8]
+        slug = slug[:COLLECTION_SUFFIX_MAX - 2 - len(digest) - 1].rstrip("-_") + "-" + digest
+    return "__" + slug
+
+def get_embedding_backend(kind=None):
+    """Builds the backend selected by EMBEDDING_BACKEND (nothing is loaded until first use)."""
+    kind = (kind or EMBEDDING_BACKEND).lower()
+    if kind in ("sentence-transformers", "sentence_transformers", "local"):
+        return SentenceTransformerBackend()
+    if kind == "chroma":
+        return ChromaDefaultBackend()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {kind}")
@@ -1,14 +1,17 @@
 from google import genai
 from google.genai import types
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from kroger import KrogerAPI
-from qloo import get_parsed_recommendations, UserProfile
-import chromadb
-from chromadb.config import Settings
+from qloo import build_recommendation_params, get_parsed_recommendations, signal_fingerprint, UserProfile
 import uuid
 from Database.product import Product
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from llm_cache import GenerationCache, cached_generate_content
+from embeddings import CachedQueryEmbedder, collection_suffix, get_embedding_backend
 from typing import Optional
 import datetime
 
@@ -18,192 +21,609 @@ class ProductSchema(BaseModel):
     promo_price: Optional[float] = None
     fulfillment_type: str = "UNKNOWN"
     brand: str = "N/A"
-    inventory: str = "UNKNOWN"  
+    inventory: str = "UNKNOWN"
     size: str = "N/A"
     last_updated: Optional[datetime.datetime] = None
     location_ID: str = "N/A"
     upc: str = "N/A"
     category: str = "Uncategorized"
 
-# Create KrogerAPI instance
-kroger_api = KrogerAPI()
+class SimilarItemSchema(BaseModel):
+    name: str
+    description: str
 
+class SimilarProductsSchema(BaseModel):
+    product: str
+    items: list[SimilarItemSchema]
 
+class SwapChoiceSchema(BaseModel):
+    item: str
+    choice: int
 
 load_dotenv("../.env")
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-chroma_client = chromadb.Client()
-collection = chroma_client.get_or_create_collection(name="my_collection")
+GEMINI_MODEL = "gemini-2.0-flash-lite"
+COLLECTION_NAME = "my_collection"
+# How retreive() phrases a query before embedding it
+QUERY_TEMPLATE = os.getenv("EMBEDDING_QUERY_TEMPLATE", "Please find relevant items related to {query}")
+# Documents per Chroma get/upsert round trip during ingestion
+EMBED_UPSERT_BATCH = int(os.getenv("EMBED_UPSERT_BATCH", "64"))
+# On-disk Chroma store, so embeddings survive restarts instead of being regenerated
+CHROMA_PATH = os.getenv("CHROMA_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"))
+# Memoized generate_content responses; set GEMINI_CACHE_FILE="" to keep them in memory only
+GEMINI_CACHE_FILE = os.getenv("GEMINI_CACHE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gemini_cache.sqlite3"))
+GEMINI_CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", 7 * 24 * 3600))
+GEMINI_CACHE_SIZE = int(os.getenv("GEMINI_CACHE_SIZE", "5000"))
+# Products per batched similar_products_many request, and parallel per-item fallbacks
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "20"))
+GEMINI_FALLBACK_CONCURRENCY = int(os.getenv("GEMINI_FALLBACK_CONCURRENCY", "4"))
+# smart_swap: "structured" (default), "score" (no LLM) or "tools" (model-driven Kroger searches)
+SWAP_MODE = os.getenv("GEMINI_SWAP_MODE", "structured")
+SWAP_CANDIDATES_PER_ITEM = int(os.getenv("GEMINI_SWAP_CANDIDATES", "3"))
+# Tool-driven smart_swap answers embed live Kroger prices, so they are reused for minutes, not days
+GEMINI_SWAP_CACHE_TTL = float(os.getenv("GEMINI_SWAP_CACHE_TTL", "300"))
 
 
 test_user = UserProfile(
     age=15,
-    gender="female", 
+    gender="female",
     city="Los Angeles",
     favorite_tags=["urn:tag:genre:place:restaurant:chinese", "urn:tag:genre:place:restaurant:italian"],
     audiences=["foodies"],
-    dietary_restrictions=[]  
+    dietary_restrictions=[]
 )
 
+class GeminiService:
+    """
+    Owns the Kroger, Gemini and Chroma clients used by the smart-swap pipeline.
+
+    Nothing touches the network at construction: each client is built on first
+    use (once, under a lock), or all at once by calling startup().
+    """
+
+    def __init__(self, user_profile=None):
+        self.user_profile = user_profile or test_user
+        self._kroger_api = None
+        self._client = None
+        self._chroma_client = None
+        self._collection = None
+        self._indexed_sources = set()
+        # Documents and queries are embedded here, not by the collection (see embeddings.py)
+        self.embedder = CachedQueryEmbedder(get_embedding_backend())
+        # One collection per embedding model, so vectors from different models never mix
+        self.collection_name = COLLECTION_NAME + collection_suffix(self.embedder)
+        self.generation_cache = GenerationCache(
+            path=GEMINI_CACHE_FILE or None, ttl=GEMINI_CACHE_TTL, maxsize=GEMINI_CACHE_SIZE, name="gemini_generate"
+        )
+        # One lock per client so a slow Kroger token fetch doesn't hold up Gemini
+        self._kroger_lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self._collection_lock = threading.Lock()
+
+    @property
+    def kroger_api(self):
+        if self._kroger_api is None:
+            with self._kroger_lock:
+                if self._kroger_api is None:
+                    # Imported here: constructing KrogerAPI fetches a service token
+                    from kroger import KrogerAPI
+                    self._kroger_api = KrogerAPI()
+        return self._kroger_api
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+        return self._client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._collection_lock:
+                if self._collection is None:
+                    import chromadb
+                    os.makedirs(CHROMA_PATH, exist_ok=True)
+                    self._chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+                    self._collection = self._chroma_client.get_or_create_collection(name=self.collection_name)
+                    self._indexed_sources = self._load_indexed_sources()
+        return self._collection
+
+    def startup(self):
+        """Builds every client now, e.g. from a worker's post-fork hook, instead of on first request."""
+        self.client
+        self.warm_load()
+        self.kroger_api
+        return self
+
+    def warm_load(self):
+        """
+        Opens the persisted collection, loads the embedding model and runs one
+        query, so the first real query doesn't pay for loading either.
+        """
+        count = self.collection.count()
+        vector = self.embedder.embed_query(QUERY_TEMPLATE.format(query="groceries"))
+        if count:
+            self.collection.query(query_embeddings=[vector], n_results=1)
+        print(f"✅ Loaded {count} embedded documents from {CHROMA_PATH} ({self.collection_name})")
+        return count
+
+    # --- Index bookkeeping ---
+    # Sources (a product's similar items, a profile's Qloo suggestions) that have
+    # already been embedded are recorded next to the collection, so embedding()
+    # can skip the Qloo/Gemini calls that would regenerate them.
+
+    def _indexed_sources_path(self):
+        return os.path.join(CHROMA_PATH, f"indexed_sources{collection_suffix(self.embedder)}.json")
+
+    def _load_indexed_sources(self):
+        try:
+            with open(self._indexed_sources_path(), 'r') as f:
+                return set(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return set()
+
+    def _mark_indexed(self, source):
+        with self._collection_lock:
+            self._indexed_sources.add(source)
+            path = self._indexed_sources_path()
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(sorted(self._indexed_sources), f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Could not persist indexed sources: {e}")
+
+    def is_indexed(self, source):
+        self.collection
+        return source in self._indexed_sources
+
+    def upsert_documents(self, items):
+        """
+        Upserts "Name: description" lines, skipping any already stored with identical content.
+
+        Returns:
+            int: Number of documents written
+        """
+        documents = {}
+        for item in valid_documents(items):
+            name = item.split(":",1)[0].strip()
+            # Later duplicates win, as they did with a single upsert call
+            documents[deterministic_id(name)] = (name, item)
+        if not documents:
+            return 0
+
+        ids = list(documents)
+        written = 0
+        for start in range(0, len(ids), EMBED_UPSERT_BATCH):
+            batch = ids[start:start + EMBED_UPSERT_BATCH]
+            existing = self.collection.get(ids=batch, include=["metadatas"])
+            stored_hashes = {
+                id_: (meta or {}).get("content_hash")
+                for id_, meta in zip(existing["ids"], existing["metadatas"])
+            }
+            new_ids = [id_ for id_ in batch if stored_hashes.get(id_) != content_hash(documents[id_][1])]
+            if not new_ids:
+                continue
+
+            new_docs = [documents[id_][1] for id_ in new_ids]
+            self.collection.upsert(
+                ids=new_ids,
+                embeddings=self.embedder.embed_documents(new_docs),
+                documents=new_docs,
+                metadatas=[{"name": documents[id_][0], "content_hash": content_hash(doc)} for id_, doc in zip(new_ids, new_docs)],
+            )
+            written += len(new_ids)
+        return written
+
+    def generate(self, contents, config=None, ttl=None, parse=None):
+        """generate_content on GEMINI_MODEL, served from the generation cache when the same request was seen."""
+        return cached_generate_content(
+            self.client, self.generation_cache, GEMINI_MODEL, contents, config=config, ttl=ttl, parse=parse
+        )
+
+    def generation_cache_stats(self):
+        return self.generation_cache.stats()
+
+    def query_cache_stats(self):
+        return self.embedder.stats()
+
+    def search_kroger_products(self, search_term: str, limit: int) -> list[dict]:
+        try:
+            return self.kroger_api.productSearchDicts(search_term, limit=limit)
+        except Exception as e:
+            print(f"Kroger API error: {e}")
+            return []
+
+    def similar_products(self, product: str) -> list[str]:
+        prompt = (
+            f"You are a grocery-expert recommender, with knowledge in the composition and popularity of foods.\n"
+            f"Generate 5 groceries similar to '{product}'.\n"
+            "Output only the items and a 100 character max detailed description of only the ITEM itself, one per line, with no bullets or numbering.\n"
+            "Example: Cranberry: Tart, red berry, popular for sauces, juices, and vitamin D benefits\n"
+        )
+
+        response = self.generate(prompt)
+        raw = response.text.strip()
+        items = [line.strip() for line in raw.splitlines() if line.strip()]
+
+        return items
+
+    def similar_products_many(self, products: list[str], per_product: int = 5) -> dict[str, list[str]]:
+        """
+        similar_products for many products, one structured-output request per GEMINI_BATCH_SIZE products.
+
+        Products the batched response leaves out (or the whole batch, if its
+        request fails) are retried individually with similar_products.
+
+        Returns:
+            dict: product -> "Name: description" lines, in the same format as similar_products
+        """
+        unique = list(dict.fromkeys(p.strip() for p in products if p and p.strip()))
+        results = {}
+        missing = []
+        for start in range(0, len(unique), GEMINI_BATCH_SIZE):
+            chunk = unique[start:start + GEMINI_BATCH_SIZE]
+            try:
+                found = self._similar_products_batch(chunk, per_product)
+            except Exception as e:
+                print(f"Batched similar_products failed, falling back per item: {e}")
+                found = {}
+            results.update(found)
+            missing.extend(p for p in chunk if p not in found)
+
+        if missing:
+            def fallback(product):
+                try:
+                    return self.similar_products(product)
+                except Exception as e:
+                    print(f"similar_products failed for {product}: {e}")
+                    return []
+            with ThreadPoolExecutor(max_workers=min(GEMINI_FALLBACK_CONCURRENCY, len(missing))) as executor:
+                results.update(zip(missing, executor.map(fallback, missing)))
+
+        return {product: results.get(product, []) for product in unique}
+
+    def _similar_products_batch(self, products: list[str], per_product: int) -> dict[str, list[str]]:
+        """One request for `products`; returns only the products the response actually covered."""
+        listed = "\n".join(products)
+        prompt = (
+            f"You are a grocery-expert recommender, with knowledge in the composition and popularity of foods.\n"
+            f"For EACH product below, generate {per_product} groceries similar to it.\n"
+            "Give each grocery a name and a 100 character max detailed description of only the ITEM itself.\n"
+            "Return one entry per product, with `product` copied exactly as given.\n"
+            "Example item: name 'Cranberry', description 'Tart, red berry, popular for sauces, juices, and vitamin D benefits'\n"
+            f"Products:\n{listed}"
+        )
+        config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=list[SimilarProductsSchema]
+        )
+        response = self.generate(prompt, config=config, parse=_similar_products_adapter.validate_json)
+
+        by_key = {product.lower(): product for product in products}
+        found = {}
+        for entry in response.parsed or []:
+            product = by_key.get(entry.product.strip().lower())
+            items = [f"{item.name.strip()}: {item.description.strip()}" for item in entry.items if item.name.strip()]
+            if product is not None and items:
+                found[product] = items
+        return found
+
+    def qloo_suggestions(self) -> list[str]:
+        recommendations = get_parsed_recommendations(self.user_profile)
+        if not recommendations:
+            # Qloo failed or had nothing; an empty list prompt would only get chatter back
+            return []
+        formatted = "\n".join([rec['name'] for rec in recommendations])
+        prompt = (
+            f"You are a grocery-expert recommender, with knowledge in the composition and popularity of foods.\n"
+            "Output only the items given and a 100 character max detailed description of only the ITEM itself, one per line, with no bullets or numbering.\n"
+            "Example: Cranberry: Tart, red berry, popular for sauces, juices, and health benefits\n"
+            f"List of items: \n{formatted}"
+        )
+        response = self.generate(prompt)
+        raw = response.text.strip()
+        items = [line.strip() for line in raw.splitlines() if line.strip()]
+        return items
+
+    def qloo_suggestions_with_affinity(self) -> list[dict]:
+        """Get Qloo suggestions with affinity scores"""
+        return get_parsed_recommendations(self.user_profile)
+
+    def _qloo_source(self):
+        params = build_recommendation_params(self.user_profile)
+        return f"qloo:{signal_fingerprint(params)}" if params else None
+
+    def embedding(self, product, refresh=False):
+        """
+        Adds the user's Qloo suggestions and items similar to `product` to the collection.
+
+        Sources embedded on an earlier run are skipped (no Qloo or Gemini calls)
+        unless `refresh` is set. The remaining sources are generated concurrently
+        and each is upserted as soon as it arrives.
+
+        Returns:
+            int: Number of documents written
+        """
+        sources = [
+            (self._qloo_source(), self.qloo_suggestions),
+            (f"similar:{product.strip().lower()}", lambda: self.similar_products(product)),
+        ]
+        pending = [(source, generate) for source, generate in sources
+                   if source is None or refresh or not self.is_indexed(source)]
+        if not pending:
+            return 0
+
+        written = 0
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="embedding") as executor:
+            futures = {executor.submit(generate): source for source, generate in pending}
+            # Upserts stay on this thread; only the upstream calls run in parallel
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    items = future.result()
+                except Exception as e:
+                    print(f"Embedding source {source} failed: {e}")
+                    continue
+                documents = valid_documents(items)
+                if not documents:
+                    # Leave the source unmarked so the next run tries again
+                    print(f"Embedding source {source} produced no usable items")
+                    continue
+                written += self.upsert_documents(documents)
+                if source is not None:
+                    self._mark_indexed(source)
+        return written
+
+    def retreive(self, query):
+        query_embedding = self.embedder.embed_query(QUERY_TEMPLATE.format(query=query))
+        response=self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=3
+        )
+
+        names = [meta['name'] for meta in response['metadatas'][0]]
+        return names
+
+    def smart_swap(self, product, mode=None):
+        """
+        Finds up to 3 Kroger products to swap in for `product`.
+
+        Modes (default GEMINI_SWAP_MODE):
+            "structured": search Kroger for the 3 retrieved candidates concurrently,
+                then one structured-output call picks a listing for each
+            "score": same searches, listings picked by score_swap_candidate; no LLM call
+            "tools": the model drives search_kroger_products itself (several round trips)
+        """
+        mode = mode or SWAP_MODE
+        names = self.retreive(product)
+        if mode == "tools":
+            return self._smart_swap_with_tools(product, names)
+
+        search_results = self.kroger_api.productSearchMany(names, limit=SWAP_CANDIDATES_PER_ITEM)
+        candidates = {result['term']: result['products'] for result in search_results if result['products']}
+
+        picks = None
+        if mode == "structured" and candidates:
+            try:
+                picks = self._pick_swaps_with_llm(product, candidates)
+            except Exception as e:
+                print(f"Structured swap pick failed, scoring instead: {e}")
+        if picks is None:
+            picks = {name: max(products, key=lambda p: score_swap_candidate(name, p)) for name, products in candidates.items()}
+
+        # Keep retrieval order
+        product_objects = [picks[name] for name in names if name in picks]
+        for product_obj in product_objects:
+            print(f"Selected Product: {product_obj.name} - ${product_obj.price}")
+        print(f"Returned {len(product_objects)} Product objects")
+        return product_objects
+
+    def _pick_swaps_with_llm(self, product, candidates):
+        """One structured-output call choosing a listing per candidate; returns name -> Product, or None if unusable."""
+        sections = []
+        for name, products in candidates.items():
+            options = "\n".join(
+                f"  {i}. {p.name} | brand: {p.brand} | size: {p.size} | price: {p.price} | promo: {p.promo_price} | stock: {p.inventory}"
+                for i, p in enumerate(products)
+            )
+            sections.append(f"{name}:\n{options}")
+        prompt = (
+            f"You are a groceries expert and recommender. A shopper wants alternatives to '{product}'.\n"
+            "For each item below, choose the Kroger listing that best matches the item, preferring in-stock and good value.\n"
+            "Answer with one entry per item: `item` copied exactly as given, and `choice` the listing number.\n\n"
+            + "\n\n".join(sections)
+        )
+        config = types.GenerateContentConfig(
+            temperature=0,
+            response_mime_type="application/json",
+            response_schema=list[SwapChoiceSchema]
+        )
+        # Prices are part of the prompt, so a cached answer is only reused for the same listings
+        response = self.generate(prompt, config=config, parse=_swap_choice_adapter.validate_json)
+        if not response.parsed:
+            return None
+
+        by_key = {name.lower(): name for name in candidates}
+        picks = {}
+        for choice in response.parsed:
+            name = by_key.get(choice.item.strip().lower())
+            if name is not None and 0 <= choice.choice < len(candidates[name]):
+                picks[name] = candidates[name][choice.choice]
+        # Anything the model skipped or mis-numbered is scored instead
+        for name, products in candidates.items():
+            if name not in picks:
+                picks[name] = max(products, key=lambda p: score_swap_candidate(name, p))
+        return picks
+
+    def _smart_swap_with_tools(self, product, names):
+        config = types.GenerateContentConfig(
+            tools=[search_kroger_products],
+            response_mime_type="application/json",
+            response_schema=list[ProductSchema]
+        )
+
+        response = self.generate(
+            f"""
+            You are a groceries expert and recommender. Here are 3 similar products to {product}:
+            {', '.join(names)}
+
+            For each of these 3 products, search for them using search_kroger_products function.
+            From the Kroger API results, select the best matching products and return them as a structured list.
+
+            Return exactly 3 products with all their details (name, price, brand, category, etc.).
+            """,
+            config=config,
+            ttl=GEMINI_SWAP_CACHE_TTL,
+            parse=_product_list_adapter.validate_json
+        )
+
+        # Convert ProductSchema objects to Product objects
+        product_objects = []
+        if hasattr(response, 'parsed') and response.parsed:
+            for product_schema in response.parsed:
+                product_dict = product_schema.model_dump()
+                product_obj = Product.from_dict(product_dict)
+                product_objects.append(product_obj)
+                print(f"Created Product: {product_obj.name} - ${product_obj.price}")
+
+        print(f"Returned {len(product_objects)} Product objects")
+        return product_objects
+
+    def suggestions_retreive(self):
+        """Get the 5 products with highest affinity scores from Qloo and search Kroger for them"""
+
+        qloo_recs = self.qloo_suggestions_with_affinity()
+
+        top_5_recs = sorted(qloo_recs, key=lambda x: x.get('affinity', 0), reverse=True)[:5]
+
+        print(f"Top 5 highest affinity products:")
+        for i, rec in enumerate(top_5_recs, 1):
+            print(f"{i}. {rec['name']} (Affinity: {rec.get('affinity', 0):.3f})")
+
+
+        product_objects = []
+        search_results = self.kroger_api.productSearchMany([rec['name'] for rec in top_5_recs], limit=1)
+        for result in search_results:
+            product_name = result['term']
+            if result['products']:
+                product_obj = result['products'][0]
+                product_objects.append(product_obj)
+                print(f"  Found: {product_obj.name} - ${product_obj.price}")
+            elif result['error']:
+                print(f"  Kroger search failed for {product_name}: {result['error']}")
+            else:
+                print(f"  No Kroger results found for: {product_name}")
+
+        print(f"Returned {len(product_objects)} Product objects from Kroger")
+        return product_objects
+
+_product_list_adapter = TypeAdapter(list[ProductSchema])
+_similar_products_adapter = TypeAdapter(list[SimilarProductsSchema])
+_swap_choice_adapter = TypeAdapter(list[SwapChoiceSchema])
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service() -> GeminiService:
+    """The process-wide GeminiService, created (without any network calls) on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeminiService()
+    return _service
+
+def generation_cache_stats() -> dict:
+    return get_service().generation_cache_stats()
+
+def startup() -> GeminiService:
+    """Eagerly builds the shared service's clients."""
+    return get_service().startup()
+
+def deterministic_id(name: str) -> str:
+
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, name))
+
+def content_hash(document: str) -> str:
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+def valid_documents(items) -> list[str]:
+    """The "Name: description" lines in `items`, dropping any model chatter without both parts."""
+    documents = []
+    for item in items:
+        name, sep, description = item.partition(":")
+        if sep and name.strip() and description.strip():
+            documents.append(item)
+    return documents
+
+OUT_OF_STOCK_LEVELS = {"TEMPORARILY_OUT_OF_STOCK", "OUT_OF_STOCK"}
+
+def score_swap_candidate(name: str, product) -> float:
+    """
+    Heuristic fit of a Kroger listing for a swap candidate: word overlap
+    between the candidate name and the listing name, plus small bonuses for
+    being in stock and on promotion.
+    """
+    wanted = set(name.lower().split())
+    listed = set((product.name or "").lower().split())
+    score = len(wanted & listed) / len(wanted) if wanted else 0.0
+    if product.inventory not in OUT_OF_STOCK_LEVELS:
+        score += 0.2
+    if product.promo_price and product.price and product.promo_price < product.price:
+        score += 0.1
+    return score
+
+# Module-level entry points, kept for existing callers; all delegate to the shared service.
+
 def search_kroger_products(search_term: str, limit: int) -> list[dict]:
     """Search for products using Kroger API.
-    
+
     Args:
         search_term: Product name to search for
         limit: Maximum number of products to return
-        
+
     Returns:
         List of product dictionaries from Kroger stores
     """
-    try:
-        products = kroger_api.productSearch(search_term, limit=limit)
-        return [product.to_dict() for product in products] if products else []
-    except Exception as e:
-        print(f"Kroger API error: {e}")
-        return []
-    
+    return get_service().search_kroger_products(search_term, limit)
+
 def similar_products(product: str) -> list[str]:
-    prompt = (
-        f"You are a grocery-expert recommender, with knowledge in the composition and popularity of foods.\n"
-        f"Generate 5 groceries similar to '{product}'.\n"
-        "Output only the items and a 100 character max detailed description of only the ITEM itself, one per line, with no bullets or numbering.\n"
-        "Example: Cranberry: Tart, red berry, popular for sauces, juices, and vitamin D benefits\n"
-    )
-    
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-lite",
-        contents=prompt
-    )
-    raw = response.text.strip()  
-    items = [line.strip() for line in raw.splitlines() if line.strip()]
-
-    return items
+    return get_service().similar_products(product)
+
+def similar_products_many(products: list[str], per_product: int = 5) -> dict[str, list[str]]:
+    return get_service().similar_products_many(products, per_product)
 
 def qloo_suggestions() -> list[str]:
-    recommendations = get_parsed_recommendations(test_user)
-    formatted = "\n".join([rec['name'] for rec in recommendations])
-    prompt = (
-        f"You are a grocery-expert recommender, with knowledge in the composition and popularity of foods.\n"
-        "Output only the items given and a 100 character max detailed description of only the ITEM itself, one per line, with no bullets or numbering.\n"
-        "Example: Cranberry: Tart, red berry, popular for sauces, juices, and health benefits\n"
-        f"List of items: \n{formatted}"
-    )
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-lite",
-        contents=prompt
-    )
-    raw = response.text.strip()  
-    items = [line.strip() for line in raw.splitlines() if line.strip()]
-    return items
+    return get_service().qloo_suggestions()
 
 def qloo_suggestions_with_affinity() -> list[dict]:
     """Get Qloo suggestions with affinity scores"""
-    return get_parsed_recommendations(test_user)
+    return get_service().qloo_suggestions_with_affinity()
 
-def deterministic_id(name: str) -> str:
-
-    return str(uuid.uuid5(uuid.NAMESPACE_DNS, name))
-
-def embedding(product):
-    data = qloo_suggestions() + similar_products(product)
-    ids   = []
-    docs  = []
-    metas = []
-    for item in data:
-        name = item.split(":",1)[0].strip()
-        id_  = deterministic_id(name)
-        ids.append(id_)
-        docs.append(item)
-        metas.append({"name": name})
-
-    collection.upsert(
-        ids=ids,
-        documents=docs,
-        metadatas=metas,
-    )
+def embedding(product, refresh=False):
+    return get_service().embedding(product, refresh=refresh)
 
 def retreive(query):
-    response=collection.query(
-        query_texts=f"Please find relevant items related to {query}",
-        n_results=3
-    )
-
-    names = [meta['name'] for meta in response['metadatas'][0]]
-    return names
-
-def smart_swap(product): 
-    names = retreive(product)
-
-    config = types.GenerateContentConfig(
-        tools=[search_kroger_products],
-        response_mime_type="application/json",
-        response_schema=list[ProductSchema]
-    )
-
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-lite",
-        contents=f"""
-        You are a groceries expert and recommender. Here are 3 similar products to {product}:
-        {', '.join(names)}
-        
-        For each of these 3 products, search for them using search_kroger_products function.
-        From the Kroger API results, select the best matching products and return them as a structured list.
-        
-        Return exactly 3 products with all their details (name, price, brand, category, etc.).
-        """,
-        config=config
-    )
-
-    # Convert ProductSchema objects to Product objects
-    product_objects = []
-    if hasattr(response, 'parsed') and response.parsed:
-        for product_schema in response.parsed:
-            product_dict = product_schema.model_dump()
-            product_obj = Product.from_dict(product_dict)
-            product_objects.append(product_obj)
-            print(f"Created Product: {product_obj.name} - ${product_obj.price}")
-
-    print(f"Returned {len(product_objects)} Product objects")
-    return product_objects
+    return get_service().retreive(query)
 
+def smart_swap(product, mode=None):
+    return get_service().smart_swap(product, mode=mode)
 
 def suggestions_retreive():
     """Get the 5 products with highest affinity scores from Qloo and search Kroger for them"""
+    return get_service().suggestions_retreive()
+
+
+if __name__ == "__main__":
+    startup()
+
+    # Test the affinity-based suggestions
+    print("Testing suggestions_retreive with affinity scores:")
+    top_suggestions = suggestions_retreive()
 
-    qloo_recs = qloo_suggestions_with_affinity()
-
-    top_5_recs = sorted(qloo_recs, key=lambda x: x.get('affinity', 0), reverse=True)[:5]
-    
-    print(f"Top 5 highest affinity products:")
-    for i, rec in enumerate(top_5_recs, 1):
-        print(f"{i}. {rec['name']} (Affinity: {rec.get('affinity', 0):.3f})")
-    
-
-    product_objects = []
-    for rec in top_5_recs:
-        product_name = rec['name']
-        print(f"Searching Kroger for: {product_name}")
-        
-
-        kroger_results = search_kroger_products(product_name, limit=1)
-        
-        if kroger_results:
-            product_dict = kroger_results[0]
-            product_obj = Product.from_dict(product_dict)
-            product_objects.append(product_obj)
-            print(f"  Found: {product_obj.name} - ${product_obj.price}")
-        else:
-            print(f"  No Kroger results found for: {product_name}")
-    
-    print(f"Returned {len(product_objects)} Product objects from Kroger")
-    return product_objects
-
-
-
-# Test the affinity-based suggestions
-print("Testing suggestions_retreive with affinity scores:")
-top_suggestions = suggestions_retreive()
-
-embedding("tangerine")  
-smart_swap("tangerine")
\ No newline at end of file
+    embedding("tangerine")
+    smart_swap("tangerine")
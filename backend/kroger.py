@@ -1,15 +1,349 @@
 import requests
+import random
+from abc import ABC, abstractmethod
 import base64
 import os
 import json
+import threading
+import time
 from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 from Database.product import Product
 from Database.user import User
+from Database import db_utils
+from cache import TTLCache
+
+class LocationCache:
+    """
+    Caches zip/radius -> store lookups from /v1/locations.
+
+    Entries live in memory and, if `path` is given, are mirrored to a JSON file
+    so a restarted worker starts warm. Expiry on disk is stored as wall-clock time.
+    """
+
+    def __init__(self, ttl, path=None, maxsize=4096):
+        self.ttl = ttl
+        self.path = path
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl, name="kroger_locations")
+        self._disk = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(zip_code, radius):
+        return f"{zip_code}|{radius}"
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        now = time.time()
+        for key, entry in entries.items():
+            remaining = entry.get('expires_at', 0) - now
+            if remaining > 0:
+                self._disk[key] = entry
+                self._memory.set(key, entry['location'], ttl=remaining)
+
+    def _persist(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._disk, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, zip_code, radius):
+        return self._memory.get(self.key(zip_code, radius))
+
+    def set(self, zip_code, radius, location):
+        key = self.key(zip_code, radius)
+        self._memory.set(key, location)
+        if not self.path:
+            return
+        with self._lock:
+            now = time.time()
+            self._disk = {k: e for k, e in self._disk.items() if e.get('expires_at', 0) > now}
+            self._disk[key] = {'location': location, 'expires_at': now + self.ttl}
+            try:
+                self._persist()
+            except OSError as e:
+                print(f"Could not persist location cache: {e}")
+
+    def stats(self):
+        return self._memory.stats()
+
+# Per-user token refreshes are serialized on a fixed set of striped locks
+# (hash(user_id) % N), so memory stays bounded however many users refresh.
+USER_TOKEN_LOCK_STRIPES = int(os.getenv("KROGER_USER_LOCK_STRIPES", "64"))
+
+def user_lock_stripe(user_id, stripes=USER_TOKEN_LOCK_STRIPES):
+    """Index of the lock stripe guarding `user_id`'s token refresh."""
+    return hash(user_id) % stripes
+
+# Cart tokens are refreshed this many seconds before their real expiry
+USER_TOKEN_EXPIRY_BUFFER = 300
+
+def user_token_expiring(token_info):
+    return time.time() >= token_info.get('expires_at', 0) - USER_TOKEN_EXPIRY_BUFFER
+
+def basic_auth_header(client_id, client_secret):
+    """Base64 client credentials for Kroger's OAuth token endpoint."""
+    credentials = f"{client_id}:{client_secret}"
+    return f"Basic {base64.b64encode(credentials.encode()).decode()}"
+
+def backoff_delay(attempt, base, maximum, response=None):
+    """Exponential backoff with full jitter, honouring Retry-After when Kroger sends it."""
+    if response is not None and response.headers.get('Retry-After'):
+        try:
+            return min(float(response.headers['Retry-After']), maximum)
+        except ValueError:
+            pass
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+def search_cache_key(search_term, limit, location_id, as_dicts=False):
+    """Search cache key; terms differing only in case or whitespace share an entry."""
+    return (" ".join(search_term.lower().split()), location_id, limit, as_dicts)
+
+class TokenStore(ABC):
+    """
+    Where users' Kroger OAuth tokens live.
+
+    Token info is a dict with 'access_token', 'refresh_token', 'token_type' and
+    'expires_at' (epoch seconds). Reads are served from an in-memory cache;
+    writes go to the backing store first and then replace the cached entry.
+    Subclasses implement _read/_write.
+    """
+
+    def __init__(self, cache_ttl=60.0, cache_size=10000):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl, name="kroger_user_tokens")
+
+    def load(self, user_id, bypass_cache=False):
+        """Returns a copy of the user's token info, or None if they haven't authorized."""
+        if not bypass_cache:
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                return dict(cached)
+        token_info = self._read(user_id)
+        if token_info is None:
+            return None
+        self._cache.set(user_id, token_info)
+        return dict(token_info)
+
+    def save(self, user_id, token_info):
+        if not self._write(user_id, token_info):
+            return False
+        self._cache.set(user_id, dict(token_info))
+        return True
+
+    def refresh(self, user_id, refresh):
+        """
+        Replaces the user's stored token info with refresh(token_info).
+
+        `refresh` gets a copy of the stored token info, read from the backing
+        store, and returns the token info to keep (the same values if no refresh
+        was needed) or None on failure. This default doesn't lock the backing
+        store; DatabaseTokenStore serializes refreshes across processes.
+
+        Returns:
+            dict: The token info now stored, or None
+        """
+        token_info = self._read(user_id)
+        if token_info is None:
+            return None
+        new_token_info = refresh(dict(token_info))
+        if new_token_info is None:
+            return None
+        if new_token_info != token_info and not self._write(user_id, new_token_info):
+            return None
+        self._cache.set(user_id, dict(new_token_info))
+        return dict(new_token_info)
+
+    @abstractmethod
+    def _read(self, user_id):
+        """Returns the stored token info dict for `user_id`, or None."""
+
+    @abstractmethod
+    def _write(self, user_id, token_info):
+        """Persists `token_info` for `user_id`; returns True on success."""
+
+class DatabaseTokenStore(TokenStore):
+    """
+    Per-user tokens in the users.access_token/refresh_token/token_type/token_expiry columns.
+    Refreshes hold the users row lock, so gunicorn workers never spend one refresh token twice.
+    """
+
+    @staticmethod
+    def _token_info(row):
+        if not row or not row['access_token']:
+            return None
+        expiry = row['token_expiry']
+        return {
+            'access_token': row['access_token'],
+            'refresh_token': row['refresh_token'],
+            'token_type': row['token_type'],
+            'expires_at': expiry.timestamp() if expiry else 0
+        }
+
+    @staticmethod
+    def _token_row(token_info):
+        return {
+            'access_token': token_info.get('access_token'),
+            'refresh_token': token_info.get('refresh_token'),
+            'token_type': token_info.get('token_type'),
+            'token_expiry': datetime.fromtimestamp(token_info.get('expires_at', 0), timezone.utc)
+        }
+
+    def _read(self, user_id):
+        if user_id is None:
+            return None
+        return self._token_info(db_utils.get_user_tokens(user_id))
+
+    def _write(self, user_id, token_info):
+        if user_id is None:
+            return False
+        row = self._token_row(token_info)
+        return db_utils.save_user_tokens(
+            user_id, row['access_token'], row['refresh_token'], row['token_type'], row['token_expiry']
+        )
+
+    def refresh(self, user_id, refresh):
+        if user_id is None:
+            return None
+
+        def refresh_row(row):
+            token_info = self._token_info(row)
+            if token_info is None:
+                return None
+            new_token_info = refresh(token_info)
+            return self._token_row(new_token_info) if new_token_info else None
+
+        token_info = self._token_info(db_utils.refresh_user_tokens(user_id, refresh_row))
+        if token_info is None:
+            return None
+        self._cache.set(user_id, token_info)
+        return dict(token_info)
+
+class FileTokenStore(TokenStore):
+    """
+    Single-user store in a JSON file, for local scripts such as test_kroger.py.
+    The user id is ignored; writes go to a temp file that is renamed into place.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def _read(self, user_id):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write(self, user_id, token_info):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(token_info, f, indent=2)
+            os.replace(tmp_path, self.path)
+            return True
+        except OSError:
+            return False
+
+def _product_fields(product):
+    """
+    Pull the fields we keep out of one /v1/products entry.
+
+    Returns:
+        tuple: (name, price, promo_price, fulfillment_type, brand, inventory, size, upc)
+    """
+    regular_price = None
+    promo_price = None
+    stock_level = "UNKNOWN"
+    fulfillment_type = "UNKNOWN"
+    size = None
+
+    items = product.get("items")
+    if items:
+        item = items[0]
+
+        # PRICING
+        price_info = item.get("price")
+        if price_info:
+            regular_price = price_info.get("regular")
+            promo_price = price_info.get("promo")
+
+        # FULFILLMENT
+        fulfillment = item.get("fulfillment")
+        if fulfillment:
+            if fulfillment.get('instore'):
+                fulfillment_type = "INSTORE"
+            elif fulfillment.get('delivery'):
+                fulfillment_type = "DELIVERY"
+            elif fulfillment.get('pickup'):
+                fulfillment_type = "PICKUP"
+
+        # INVENTORY
+        inventory_info = item.get("inventory")
+        if inventory_info:
+            stock_level = inventory_info.get("stockLevel", "UNKNOWN")
+
+        # SIZE
+        size = item.get("size")
+        if size == "N/A":
+            size = None
+
+    return (
+        product.get("description", "Unknown Product"), regular_price, promo_price, fulfillment_type,
+        product.get("brand", "Unknown Brand"), stock_level, size, product.get("upc", "N/A")
+    )
+
+def parse_products(products, location_id):
+    """Map a /v1/products response body to Product objects."""
+    # One timestamp per response rather than per product
+    now = datetime.now()
+    product_objects = []
+    for product in products.get("data", ()):
+        name, price, promo_price, fulfillment_type, brand, inventory, size, upc = _product_fields(product)
+        product_objects.append(
+            Product(name, price, promo_price, fulfillment_type, brand, inventory, size, now, location_ID=location_id, upc=upc)
+        )
+    return product_objects
+
+def parse_product_dicts(products, location_id):
+    """
+    Map a /v1/products response body straight to Product.to_dict()-shaped dicts,
+    skipping the intermediate Product objects for endpoints that only serialize.
+    """
+    last_updated = datetime.now().isoformat()
+    product_dicts = []
+    for product in products.get("data", ()):
+        name, price, promo_price, fulfillment_type, brand, inventory, size, upc = _product_fields(product)
+        product_dicts.append({
+            "name": name,
+            "price": float(price) if price is not None else 0.00,
+            "promo_price": float(promo_price) if promo_price is not None else None,
+            "fulfillment_type": fulfillment_type,
+            "brand": brand,
+            "inventory": inventory,
+            "size": size,
+            "last_updated": last_updated,
+            "location_ID": location_id,
+            "upc": upc,
+            "category": "Uncategorized"
+        })
+    return product_dicts
+
+class KrogerAPIError(Exception):
+    """Raised when a Kroger endpoint returns an unusable response."""
 
 class KrogerAPI:
-    def __init__(self):
+    def __init__(self, token_store=None):
         # Get absolute path to .env file
         current_dir = os.path.dirname(__file__)
         env_path = os.path.join(current_dir, "../.env")
@@ -19,41 +353,216 @@ class KrogerAPI:
         self.redirect_uri = os.getenv("KROGER_REDIRECT_URI")
         self.zip_code = os.getenv("ZIP_CODE", "98075")
         self.base_url = "https://api.kroger.com"
-        self.token_file = "kroger_tokens.json"
+        # Users' cart tokens; defaults to the users table
+        self.token_store = token_store or DatabaseTokenStore()
+        self._user_token_locks = [threading.Lock() for _ in range(USER_TOKEN_LOCK_STRIPES)]
+        self.location_radius = 10
+
+        # One pooled keep-alive session for every upstream call
+        self.timeout = float(os.getenv("KROGER_TIMEOUT", "10"))
+        self.max_retries = int(os.getenv("KROGER_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("KROGER_BACKOFF_BASE", "0.25"))
+        self.backoff_max = float(os.getenv("KROGER_BACKOFF_MAX", "8"))
+        pool_size = int(os.getenv("KROGER_POOL_SIZE", "20"))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Bounded fan-out for productSearchMany
+        self.max_concurrency = int(os.getenv("KROGER_MAX_CONCURRENCY", "8"))
+        self._search_executor = None
+        self._refresh_executor = None
+        self._executor_lock = threading.Lock()
+
+        # Search results: served fresh for KROGER_SEARCH_CACHE_TTL seconds, then served
+        # stale for up to KROGER_SEARCH_CACHE_STALE_TTL more while a background refresh runs
+        self.search_fresh_ttl = float(os.getenv("KROGER_SEARCH_CACHE_TTL", "300"))
+        self.search_stale_ttl = float(os.getenv("KROGER_SEARCH_CACHE_STALE_TTL", "600"))
+        self.search_cache = TTLCache(
+            maxsize=int(os.getenv("KROGER_SEARCH_CACHE_SIZE", "5000")),
+            ttl=self.search_fresh_ttl + self.search_stale_ttl,
+            name="kroger_search"
+        )
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._stale_hits = 0
+
+        # Zip -> store mappings rarely change, so they are cached for a week by default
+        self.location_cache = LocationCache(
+            ttl=float(os.getenv("KROGER_LOCATION_CACHE_TTL", 7 * 24 * 3600)),
+            path=os.getenv("KROGER_LOCATION_CACHE_FILE")
+        )
         
         # Initialize service token for product search
         self._service_token = None
+        self._service_token_expires_at = 0
+        self._service_token_lock = threading.Lock()
+        self._service_token_timer = None
+        # Refresh this many seconds before the token expires
+        self.token_refresh_margin = float(os.getenv("KROGER_TOKEN_REFRESH_MARGIN", "300"))
         self._get_service_token()
     
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def _backoff_delay(self, attempt, response=None):
+        return backoff_delay(attempt, self.backoff_base, self.backoff_max, response)
+
+    def _request(self, method, url, idempotent=True, **kwargs):
+        """
+        Send a request through the shared session with a timeout and retries.
+
+        429s are always retried (the request was not processed). 5xx responses and
+        connection errors are only retried for idempotent calls, so a cart PUT or a
+        single-use authorization_code / refresh_token grant is never sent twice after
+        the server may have applied it.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or last_attempt:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+            retryable = response.status_code == 429 or (idempotent and response.status_code in self.RETRY_STATUSES)
+            if not retryable or last_attempt:
+                return response
+            time.sleep(self._backoff_delay(attempt, response))
+        return response
+
     def _get_auth_header(self):
         """Create base64 encoded authorization header."""
-        credentials = f"{self.client_id}:{self.client_secret}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        return f"Basic {encoded_credentials}"
+        return basic_auth_header(self.client_id, self.client_secret)
     
-    def _get_service_token(self):
-        """Get service-to-service token for product search."""
-        token_url = f"{self.base_url}/v1/connect/oauth2/token"
-        
-        headers = {
-            'Authorization': self._get_auth_header(),
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        data = {
-            'grant_type': 'client_credentials',
-            'scope': 'product.compact'
+    def _service_token_expiring(self):
+        return time.time() >= self._service_token_expires_at - self.token_refresh_margin
+
+    def _get_service_token(self, stale_token=None):
+        """
+        Get service-to-service token for product search.
+
+        Refreshes are deduplicated: callers queue on a lock and, once inside, reuse
+        a token another thread just fetched. Pass `stale_token` (a token Kroger
+        rejected with 401) to force a refresh unless it has already been replaced.
+
+        Returns:
+            str: The current service token, or None if none could be obtained
+        """
+        with self._service_token_lock:
+            current = self._service_token
+            if current and current != stale_token and not self._service_token_expiring():
+                return current
+
+            token_url = f"{self.base_url}/v1/connect/oauth2/token"
+            
+            headers = {
+                'Authorization': self._get_auth_header(),
+                'Content-Type': 'application/x-www-form-urlencoded'
+            }
+            
+            data = {
+                'grant_type': 'client_credentials',
+                'scope': 'product.compact'
+            }
+            
+            try:
+                response = self._request('POST', token_url, headers=headers, data=data)
+                if response.status_code == 200:
+                    token_info = response.json()
+                    self._service_token = token_info.get('access_token')
+                    self._service_token_expires_at = time.time() + token_info.get('expires_in', 1800)
+                    self._schedule_service_token_refresh(
+                        self._service_token_expires_at - self.token_refresh_margin - time.time()
+                    )
+                    return self._service_token
+            except Exception:
+                pass
+
+            # Keep serving the old token while it is still valid and retry shortly.
+            self._schedule_service_token_refresh(30)
+            if current and current != stale_token and time.time() < self._service_token_expires_at:
+                return current
+            return None
+
+    def _schedule_service_token_refresh(self, delay):
+        """Refresh the service token in the background after `delay` seconds."""
+        if self._service_token_timer is not None:
+            self._service_token_timer.cancel()
+        self._service_token_timer = threading.Timer(max(delay, 1), self._get_service_token)
+        self._service_token_timer.daemon = True
+        self._service_token_timer.start()
+
+    def _ensure_service_token(self):
+        """Return a usable service token, fetching one synchronously only if it has expired."""
+        if self._service_token and time.time() < self._service_token_expires_at:
+            return self._service_token
+        return self._get_service_token()
+
+    def _service_request(self, method, url, **kwargs):
+        """
+        Call a service-token endpoint, refreshing the token and retrying once on 401.
+
+        Raises:
+            KrogerAPIError: If no service token is available
+        """
+        token = self._ensure_service_token()
+        if not token:
+            raise KrogerAPIError("No Kroger service token")
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Authorization'] = f'Bearer {token}'
+        response = self._request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            token = self._get_service_token(stale_token=token)
+            if token:
+                headers['Authorization'] = f'Bearer {token}'
+                response = self._request(method, url, headers=headers, **kwargs)
+        return response
+    
+    def resolveLocation(self, zip_code=None, radius=None):
+        """
+        Find the nearest store for a ZIP code, using the location cache when possible.
+
+        Args:
+            zip_code (str): ZIP code to search near, uses env variable if not provided
+            radius (int): Search radius in miles
+
+        Returns:
+            dict: {'location_id': ..., 'name': ...} or None if no store was found
+        """
+        zip_code = zip_code or self.zip_code
+        radius = radius or self.location_radius
+
+        cached = self.location_cache.get(zip_code, radius)
+        if cached is not None:
+            return cached
+
+        locations_url = f"{self.base_url}/v1/locations"
+        params = {
+            'filter.zipCode.near': zip_code,
+            'filter.radiusInMiles': radius,
+            'filter.limit': 1
         }
-        
+
         try:
-            response = requests.post(token_url, headers=headers, data=data)
-            if response.status_code == 200:
-                token_info = response.json()
-                self._service_token = token_info.get('access_token')
+            locs = self._service_request('GET', locations_url, params=params).json()
         except Exception:
-            pass
-    
-    def productSearch(self, search_term, limit=1, zip_code=None): #expand limit later with LLM and RAG
+            return None
+
+        if not locs.get("data"):
+            return None
+
+        store = locs["data"][0]
+        location = {
+            'location_id': store["locationId"],
+            'name': store.get("name", "Unknown Store")
+        }
+        self.location_cache.set(zip_code, radius, location)
+        return location
+
+    def productSearch(self, search_term, limit=1, zip_code=None, location_id=None): #expand limit later with LLM and RAG
         """
         Search for products using Kroger API and return Product objects.
         
@@ -61,112 +570,182 @@ class KrogerAPI:
             search_term (str): Product to search for
             limit (int): Maximum number of products to return
             zip_code (str): ZIP code for store search, uses env variable if not provided
+            location_id (str): Known Kroger store ID; skips the store lookup entirely
             
         Returns:
             list: List of Product objects, or empty list if failed
         """
-        if not zip_code:
-            zip_code = self.zip_code
-        
-        if not self._service_token:
+        if not self._ensure_service_token():
             return []
-        
-        # Find stores
-        locations_url = f"{self.base_url}/v1/locations"
-        headers = {'Authorization': f'Bearer {self._service_token}'}
-        params = {
-            'filter.zipCode.near': zip_code,
-            'filter.radiusInMiles': 10,
-            'filter.limit': 5 #expand later with LLM and RAG
-        }
-        
+
+        if not location_id:
+            location = self.resolveLocation(zip_code)
+            if location is None:
+                return []
+            location_id = location['location_id']
+
         try:
-            locs_response = requests.get(locations_url, headers=headers, params=params)
-            locs = locs_response.json()
-            
-            if locs.get("data") and len(locs["data"]) > 0:
-                store = locs["data"][0]
-                location_id = store["locationId"]
-                store_name = store.get("name", "Unknown Store")
-                
-                # Search products
-                products_url = f"{self.base_url}/v1/products"
-                product_params = {
-                    'filter.term': search_term,
-                    'filter.locationId': location_id,
-                    'filter.limit': limit
-                }
-                
-                products_response = requests.get(products_url, headers=headers, params=product_params)
-                products = products_response.json()
-                
-                # Create list of Product objects
-                product_objects = []
-                
-                for product in products.get("data", []):
-                    # Basic product info
-                    name = product.get("description", "Unknown Product")
-                    brand = product.get("brand", "Unknown Brand")
-                    upc = product.get("upc", "N/A")
-                    
-                    # Get item details
-                    items = product.get("items", [])
-                    
-                    # Initialize default values
-                    regular_price = None
-                    promo_price = None
-                    stock_level = "UNKNOWN"
-                    fulfillment_type = "UNKNOWN"
-                    size = None
-                    
-                    if items:
-                        item = items[0]
-                        
-                        # PRICING
-                        price_info = item.get("price", {})
-                        if price_info:
-                            regular_price = price_info.get("regular")
-                            promo_price = price_info.get("promo")
-                        
-                        # FULFILLMENT
-                        fulfillment = item.get("fulfillment", {})
-                        if fulfillment.get('instore', False):
-                            fulfillment_type = "INSTORE"
-                        elif fulfillment.get('delivery', False):
-                            fulfillment_type = "DELIVERY"
-                        elif fulfillment.get('pickup', False):
-                            fulfillment_type = "PICKUP"
-                        
-                        # INVENTORY
-                        inventory_info = item.get("inventory", {})
-                        stock_level = inventory_info.get("stockLevel", "UNKNOWN")
-                        
-                        # SIZE
-                        size = item.get("size", "N/A")
-                        if size == "N/A":
-                            size = None
-                    
-                    product_obj = Product(
-                        name=name,
-                        price=regular_price,
-                        promo_price=promo_price,
-                        fulfillment_type=fulfillment_type,
-                        brand=brand,
-                        inventory=stock_level,
-                        size=size,
-                        last_updated=datetime.now(),
-                        location_ID=location_id,
-                        upc=upc
-                    )
-                    
-                    product_objects.append(product_obj)
-                
-                return product_objects
-            else:
+            return self._cached_fetch_products(search_term, limit, location_id)
+        except Exception:
+            return []
+
+    def productSearchDicts(self, search_term, limit=1, zip_code=None, location_id=None):
+        """
+        Like productSearch, but returns Product.to_dict()-shaped dicts parsed straight
+        from the Kroger payload, for endpoints that only serialize the results.
+        The dicts are shared with the search cache and must be treated as read-only.
+        """
+        if not self._ensure_service_token():
+            return []
+
+        if not location_id:
+            location = self.resolveLocation(zip_code)
+            if location is None:
                 return []
-                
+            location_id = location['location_id']
+
+        try:
+            return self._cached_fetch_products(search_term, limit, location_id, as_dicts=True)
         except Exception:
             return []
+
+    def _cached_fetch_products(self, search_term, limit, location_id, as_dicts=False):
+        """
+        _fetch_products behind the search cache.
+
+        Fresh hits return immediately. Stale hits also return immediately but kick
+        off one background refresh. Concurrent misses for the same key share a
+        single upstream request.
+        """
+        key = search_cache_key(search_term, limit, location_id, as_dicts)
+        entry = self.search_cache.get(key)
+        if entry is not None:
+            products, fetched_at = entry
+            if time.monotonic() - fetched_at > self.search_fresh_ttl:
+                future, owner = self._claim_fetch(key, stale=True)
+                if owner:
+                    # Refreshes get their own small pool so they never queue behind
+                    # searches that may be waiting on them.
+                    self._get_refresh_executor().submit(self._run_fetch, key, future, search_term, limit, location_id, as_dicts)
+            return list(products)
+
+        future, owner = self._claim_fetch(key)
+        if owner:
+            self._run_fetch(key, future, search_term, limit, location_id, as_dicts)
+        return list(future.result())
+
+    def _claim_fetch(self, key, stale=False):
+        """Returns (future, owner); only the owner performs the upstream request."""
+        with self._inflight_lock:
+            if stale:
+                # Counted here because stale hits come from request and refresh threads alike
+                self._stale_hits += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _run_fetch(self, key, future, search_term, limit, location_id, as_dicts=False):
+        try:
+            products = self._fetch_products(search_term, limit, location_id, as_dicts)
+            self.search_cache.set(key, (products, time.monotonic()))
+            future.set_result(products)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def cache_stats(self):
+        """Counters for the search and location caches, for health checks."""
+        search = self.search_cache.stats()
+        with self._inflight_lock:
+            search["stale_hits"] = self._stale_hits
+        return {"search": search, "locations": self.location_cache.stats()}
+
+    def _fetch_products(self, search_term, limit, location_id, as_dicts=False):
+        """
+        Query /v1/products at one store and parse the results into Products,
+        or into response-shaped dicts if `as_dicts` is set.
+
+        Raises:
+            KrogerAPIError: If Kroger answers with a non-200 status
+        """
+        products_url = f"{self.base_url}/v1/products"
+        product_params = {
+            'filter.term': search_term,
+            'filter.locationId': location_id,
+            'filter.limit': limit
+        }
+
+        products_response = self._service_request('GET', products_url, params=product_params)
+        if products_response.status_code != 200:
+            raise KrogerAPIError(f"Product search failed with status {products_response.status_code}")
+        parse = parse_product_dicts if as_dicts else parse_products
+        return parse(products_response.json(), location_id)
+
+    def productSearchMany(self, terms, limit=1, zip_code=None, location_id=None):
+        """
+        Search for several products concurrently.
+
+        The store is resolved once, then searches fan out over a shared thread
+        pool capped at KROGER_MAX_CONCURRENCY in-flight requests per client, so
+        parallel callers together stay within Kroger's rate limits.
+
+        Args:
+            terms (list): Search terms
+            limit (int): Maximum number of products per term
+            zip_code (str): ZIP code for store search, uses env variable if not provided
+            location_id (str): Known Kroger store ID; skips the store lookup entirely
+
+        Returns:
+            list: One dict per term, in input order:
+                {'term': str, 'products': [Product, ...], 'error': str or None}
+        """
+        if not terms:
+            return []
+
+        error = None
+        if not self._ensure_service_token():
+            error = "No Kroger service token"
+        elif not location_id:
+            location = self.resolveLocation(zip_code)
+            if location is None:
+                error = "No Kroger store found near the given ZIP code"
+            else:
+                location_id = location['location_id']
+        if error:
+            return [{'term': term, 'products': [], 'error': error} for term in terms]
+
+        futures = [
+            self._get_search_executor().submit(self._cached_fetch_products, term, limit, location_id)
+            for term in terms
+        ]
+        results = []
+        for term, future in zip(terms, futures):
+            try:
+                results.append({'term': term, 'products': future.result(), 'error': None})
+            except Exception as e:
+                results.append({'term': term, 'products': [], 'error': str(e) or type(e).__name__})
+        return results
+
+    def _get_search_executor(self):
+        if self._search_executor is None:
+            with self._executor_lock:
+                if self._search_executor is None:
+                    self._search_executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency, thread_name_prefix="kroger-search"
+                    )
+        return self._search_executor
+
+    def _get_refresh_executor(self):
+        if self._refresh_executor is None:
+            with self._executor_lock:
+                if self._refresh_executor is None:
+                    self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="kroger-refresh")
+        return self._refresh_executor
     
     def getAuthorizationUrl(self, scopes="cart.basic:write profile.compact", state="auth_state"):
         """
@@ -192,12 +771,13 @@ class KrogerAPI:
         
         return full_url
     
-    def exchangeAuthCode(self, authorization_code):
+    def exchangeAuthCode(self, authorization_code, user_id=None):
         """
         Exchange authorization code for access tokens.
         
         Args:
             authorization_code (str): Code received from authorization callback
+            user_id (str): User the tokens belong to
             
         Returns:
             dict: Token information or None if failed
@@ -216,18 +796,19 @@ class KrogerAPI:
         }
         
         try:
-            response = requests.post(token_url, headers=headers, data=data)
+            # Not retried: a code is single-use, so a retry after Kroger accepted it
+            # would fail with invalid_grant and lose the tokens
+            response = self._request('POST', token_url, idempotent=False, headers=headers, data=data)
             
             if response.status_code == 200:
                 token_info = response.json()
                 
                 # Add timestamp for expiration tracking
-                import time
                 token_info['expires_at'] = time.time() + token_info.get('expires_in', 1800)
                 
                 # Save tokens
-                with open(self.token_file, 'w') as f:
-                    json.dump(token_info, f, indent=2)
+                if not self.token_store.save(user_id, token_info):
+                    return None
                 
                 return token_info
             else:
@@ -235,23 +816,36 @@ class KrogerAPI:
                 
         except Exception:
             return None
-    
-    def _refresh_token(self):
+
+    def _user_token_lock(self, user_id):
+        return self._user_token_locks[user_lock_stripe(user_id)]
+
+    def _refresh_token(self, user_id=None):
         """
-        Refresh access token using refresh token.
+        Refresh a user's access token using their refresh token.
+
+        Refreshes of one user's tokens are serialized by a striped in-process lock
+        and, for DatabaseTokenStore, by the users row lock across workers. The
+        stored tokens are re-read under both, so a refresh already done by another
+        thread or worker is reused instead of spending the refresh token again.
         
         Returns:
-            bool: True if refresh successful, False otherwise
+            dict: New token information, or None if refresh failed
         """
-        try:
-            with open(self.token_file, 'r') as f:
-                token_info = json.load(f)
-        except FileNotFoundError:
-            return False
-        
+        with self._user_token_lock(user_id):
+            return self.token_store.refresh(user_id, self._exchange_refresh_token)
+
+    def _exchange_refresh_token(self, token_info):
+        """
+        TokenStore.refresh callback: returns `token_info` unchanged if it is still
+        fresh, else new tokens from Kroger, or None if the refresh failed.
+        """
+        if not user_token_expiring(token_info):
+            return token_info
+
         refresh_token = token_info.get('refresh_token')
         if not refresh_token:
-            return False
+            return None
         
         token_url = f"{self.base_url}/v1/connect/oauth2/token"
         
@@ -266,65 +860,45 @@ class KrogerAPI:
         }
         
         try:
-            response = requests.post(token_url, headers=headers, data=data)
+            # Not retried: Kroger may rotate the refresh token on success
+            response = self._request('POST', token_url, idempotent=False, headers=headers, data=data)
             
             if response.status_code == 200:
                 new_token_info = response.json()
                 
                 # Add timestamp for expiration tracking
-                import time
                 new_token_info['expires_at'] = time.time() + new_token_info.get('expires_in', 1800)
                 
                 # Preserve refresh token if not returned
                 if 'refresh_token' not in new_token_info:
                     new_token_info['refresh_token'] = refresh_token
                 
-                # Save new tokens
-                with open(self.token_file, 'w') as f:
-                    json.dump(new_token_info, f, indent=2)
-                
-                return True
+                return new_token_info
             else:
-                return False
+                return None
                 
         except Exception:
-            return False
+            return None
     
-    def _get_valid_token(self):
+    def _get_valid_token(self, user_id=None):
         """
-        Get a valid access token, refreshing if necessary.
+        Get a valid access token for a user, refreshing if necessary.
         
         Returns:
             str: Valid access token or None if unavailable
         """
-        try:
-            with open(self.token_file, 'r') as f:
-                token_info = json.load(f)
-        except FileNotFoundError:
+        token_info = self.token_store.load(user_id)
+        if not token_info:
             return None
         
-        access_token = token_info.get('access_token')
-        expires_at = token_info.get('expires_at', 0)
-        
-        import time
-        current_time = time.time()
-        
-        # Check if token is expired (with 5 minute buffer)
-        if current_time >= (expires_at - 300):
-            if self._refresh_token():
-                # Re-read the refreshed token
-                try:
-                    with open(self.token_file, 'r') as f:
-                        token_info = json.load(f)
-                    access_token = token_info.get('access_token')
-                except:
-                    return None
-            else:
+        if user_token_expiring(token_info):
+            token_info = self._refresh_token(user_id)
+            if not token_info:
                 return None
         
-        return access_token
+        return token_info.get('access_token')
     
-    def addToCart(self, upc, quantity=1, modality="PICKUP"):
+    def addToCart(self, upc, quantity=1, modality="PICKUP", user_id=None):
         """
         Add item to user's Kroger cart.
         
@@ -332,34 +906,24 @@ class KrogerAPI:
             upc (str): UPC code of the product to add
             quantity (int): Quantity to add
             modality (str): "PICKUP" or "DELIVERY"
+            user_id (str): User whose cart (and stored tokens) to use
             
         Returns:
             bool: True if successful, False otherwise
         """
         # Get valid access token (automatically refreshes if needed)
-        access_token = self._get_valid_token()
+        access_token = self._get_valid_token(user_id)
         if not access_token:
             return False
         
-        cart_url = f"{self.base_url}/v1/cart/add"
-        
-        headers = {
-            'Authorization': f"Bearer {access_token}",
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            "items": [
+        try:
+            response = self._put_cart_items(access_token, [
                 {
                     "upc": upc,
                     "quantity": quantity,
                     "modality": modality
                 }
-            ]
-        }
-        
-        try:
-            response = requests.put(cart_url, headers=headers, json=payload)
+            ])
             
             if response.status_code == 204:
                 return True
@@ -368,6 +932,87 @@ class KrogerAPI:
                 
         except Exception:
             return False
+
+    def _put_cart_items(self, access_token, items):
+        """PUT a batch of {'upc', 'quantity', 'modality'} items to /v1/cart/add."""
+        cart_url = f"{self.base_url}/v1/cart/add"
+        
+        headers = {
+            'Authorization': f"Bearer {access_token}",
+            'Content-Type': 'application/json'
+        }
+        
+        return self._request('PUT', cart_url, idempotent=False, headers=headers, json={"items": items})
+
+    def _add_cart_chunk(self, access_token, chunk):
+        """
+        Send one chunk of (index, item) pairs. If Kroger rejects the whole chunk with
+        a 400 (typically one bad UPC), the items are retried one by one so only
+        the offending items are reported as failed.
+
+        Returns:
+            list: (index, error or None) for every item in the chunk
+        """
+        try:
+            response = self._put_cart_items(access_token, [item for _, item in chunk])
+        except Exception as e:
+            return [(index, str(e) or type(e).__name__) for index, _ in chunk]
+        if response.status_code == 204:
+            return [(index, None) for index, _ in chunk]
+        if response.status_code == 400 and len(chunk) > 1:
+            results = []
+            for pair in chunk:
+                results.extend(self._add_cart_chunk(access_token, [pair]))
+            return results
+        return [(index, f"Cart update failed with status {response.status_code}") for index, _ in chunk]
+
+    def addListToCart(self, grocery_list, modality="PICKUP", user_id=None, chunk_size=None):
+        """
+        Add every item on a grocery list to the user's Kroger cart.
+
+        Items are sent in batched PUTs of `chunk_size` items (KROGER_CART_CHUNK_SIZE,
+        default 25), with chunks running concurrently on the client's bounded pool.
+
+        Args:
+            grocery_list (GroceryList): List whose (Product, quantity) pairs to add
+            modality (str): "PICKUP" or "DELIVERY"
+            user_id (str): User whose cart (and stored tokens) to use
+            chunk_size (int): Items per PUT
+
+        Returns:
+            list: One dict per list entry, in list order:
+                {'upc', 'name', 'quantity', 'success': bool, 'error': str or None}
+
+        Raises:
+            KrogerAPIError: If the user has no valid cart authorization
+        """
+        access_token = self._get_valid_token(user_id)
+        if not access_token:
+            raise KrogerAPIError("Kroger cart access is not authorized")
+        chunk_size = chunk_size or int(os.getenv("KROGER_CART_CHUNK_SIZE", "25"))
+
+        results = []
+        sendable = []
+        for index, (product, quantity) in enumerate(grocery_list.products_on_list):
+            results.append({
+                'upc': product.upc,
+                'name': product.name,
+                'quantity': quantity,
+                'success': False,
+                'error': None
+            })
+            if not product.upc or product.upc == "N/A":
+                results[index]['error'] = "Item has no UPC"
+            else:
+                sendable.append((index, {"upc": product.upc, "quantity": quantity, "modality": modality}))
+
+        chunks = [sendable[i:i + chunk_size] for i in range(0, len(sendable), chunk_size)]
+        futures = [self._get_search_executor().submit(self._add_cart_chunk, access_token, chunk) for chunk in chunks]
+        for future in futures:
+            for index, error in future.result():
+                results[index]['success'] = error is None
+                results[index]['error'] = error
+        return results
         
 if __name__ == "__main__":
     api = KrogerAPI()
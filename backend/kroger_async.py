@@ -0,0 +1,369 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+import httpx
+from cache import TTLCache
+from kroger import (
+    USER_TOKEN_LOCK_STRIPES, DatabaseTokenStore, KrogerAPIError, LocationCache, backoff_delay,
+    basic_auth_header, parse_products, search_cache_key, user_lock_stripe, user_token_expiring
+)
+
+class AsyncKrogerAPI:
+    """
+    asyncio counterpart of KrogerAPI for ASGI handlers.
+
+    Exposes the same surface (productSearch, productSearchMany, resolveLocation,
+    addToCart, token management) on one shared httpx.AsyncClient, so a single
+    worker can keep many upstream requests in flight. Configuration comes from
+    the same KROGER_* environment variables as the sync client.
+
+    Use it as `async with AsyncKrogerAPI() as api:` or call aclose() on shutdown.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, token_store=None, client=None):
+        current_dir = os.path.dirname(__file__)
+        load_dotenv(os.path.join(current_dir, "../.env"))
+        self.client_id = os.getenv("KROGER_CLIENT_ID")
+        self.client_secret = os.getenv("KROGER_CLIENT_SECRET")
+        self.redirect_uri = os.getenv("KROGER_REDIRECT_URI")
+        self.zip_code = os.getenv("ZIP_CODE", "98075")
+        self.base_url = "https://api.kroger.com"
+        self.location_radius = 10
+
+        self.timeout = float(os.getenv("KROGER_TIMEOUT", "10"))
+        self.max_retries = int(os.getenv("KROGER_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("KROGER_BACKOFF_BASE", "0.25"))
+        self.backoff_max = float(os.getenv("KROGER_BACKOFF_MAX", "8"))
+        pool_size = int(os.getenv("KROGER_ASYNC_POOL_SIZE", "100"))
+        self.client = client or httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+        # Caps in-flight product searches per client to respect Kroger's rate limits
+        self.max_concurrency = int(os.getenv("KROGER_ASYNC_MAX_CONCURRENCY", "32"))
+        self._search_slots = asyncio.Semaphore(self.max_concurrency)
+
+        self.search_fresh_ttl = float(os.getenv("KROGER_SEARCH_CACHE_TTL", "300"))
+        self.search_stale_ttl = float(os.getenv("KROGER_SEARCH_CACHE_STALE_TTL", "600"))
+        self.search_cache = TTLCache(
+            maxsize=int(os.getenv("KROGER_SEARCH_CACHE_SIZE", "5000")),
+            ttl=self.search_fresh_ttl + self.search_stale_ttl,
+            name="kroger_search_async"
+        )
+        self._inflight = {}
+        self._background = set()
+
+        self.location_cache = LocationCache(
+            ttl=float(os.getenv("KROGER_LOCATION_CACHE_TTL", 7 * 24 * 3600)),
+            path=os.getenv("KROGER_LOCATION_CACHE_FILE")
+        )
+
+        self.token_store = token_store or DatabaseTokenStore()
+        self._user_token_locks = [asyncio.Lock() for _ in range(USER_TOKEN_LOCK_STRIPES)]
+
+        self._service_token = None
+        self._service_token_expires_at = 0
+        self._service_token_lock = asyncio.Lock()
+        self.token_refresh_margin = float(os.getenv("KROGER_TOKEN_REFRESH_MARGIN", "300"))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        for task in list(self._background):
+            task.cancel()
+        await self.client.aclose()
+
+    def _spawn(self, coro):
+        """Run `coro` in the background, keeping a reference so it isn't garbage-collected."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def _get_auth_header(self):
+        return basic_auth_header(self.client_id, self.client_secret)
+
+    def _backoff_delay(self, attempt, response=None):
+        return backoff_delay(attempt, self.backoff_base, self.backoff_max, response)
+
+    async def _request(self, method, url, idempotent=True, **kwargs):
+        """Same retry policy as KrogerAPI._request, without blocking the event loop."""
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if not idempotent or last_attempt:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+            retryable = response.status_code == 429 or (idempotent and response.status_code in self.RETRY_STATUSES)
+            if not retryable or last_attempt:
+                return response
+            await asyncio.sleep(self._backoff_delay(attempt, response))
+        return response
+
+    # --- Service token ---
+
+    def _service_token_expiring(self):
+        return time.time() >= self._service_token_expires_at - self.token_refresh_margin
+
+    async def _get_service_token(self, stale_token=None):
+        """
+        Fetch a service-to-service token; concurrent callers share one refresh.
+        Pass `stale_token` (a token Kroger rejected with 401) to force a refresh.
+        """
+        async with self._service_token_lock:
+            current = self._service_token
+            if current and current != stale_token and not self._service_token_expiring():
+                return current
+            try:
+                # Not retried: the refresh token may be single-use (see KrogerAPI._refresh_token)
+                response = await self._request(
+                    'POST', f"{self.base_url}/v1/connect/oauth2/token", idempotent=False,
+                    headers={
+                        'Authorization': self._get_auth_header(),
+                        'Content-Type': 'application/x-www-form-urlencoded'
+                    },
+                    data={'grant_type': 'client_credentials', 'scope': 'product.compact'}
+                )
+                if response.status_code == 200:
+                    token_info = response.json()
+                    self._service_token = token_info.get('access_token')
+                    self._service_token_expires_at = time.time() + token_info.get('expires_in', 1800)
+                    return self._service_token
+            except Exception:
+                pass
+            if current and current != stale_token and time.time() < self._service_token_expires_at:
+                return current
+            return None
+
+    async def _ensure_service_token(self):
+        """
+        Return a usable service token. Inside the refresh margin the current token
+        is returned immediately and a refresh runs in the background; only an
+        expired or missing token makes the caller wait.
+        """
+        if self._service_token and time.time() < self._service_token_expires_at:
+            if self._service_token_expiring() and not self._service_token_lock.locked():
+                self._spawn(self._get_service_token())
+            return self._service_token
+        return await self._get_service_token()
+
+    async def _service_request(self, method, url, **kwargs):
+        """Call a service-token endpoint, refreshing the token and retrying once on 401."""
+        token = await self._ensure_service_token()
+        if not token:
+            raise KrogerAPIError("No Kroger service token")
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Authorization'] = f'Bearer {token}'
+        response = await self._request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            token = await self._get_service_token(stale_token=token)
+            if token:
+                headers['Authorization'] = f'Bearer {token}'
+                response = await self._request(method, url, headers=headers, **kwargs)
+        return response
+
+    # --- Product search ---
+
+    async def resolveLocation(self, zip_code=None, radius=None):
+        """Async KrogerAPI.resolveLocation; shares the same LocationCache semantics."""
+        zip_code = zip_code or self.zip_code
+        radius = radius or self.location_radius
+        cached = self.location_cache.get(zip_code, radius)
+        if cached is not None:
+            return cached
+        try:
+            response = await self._service_request(
+                'GET', f"{self.base_url}/v1/locations",
+                params={'filter.zipCode.near': zip_code, 'filter.radiusInMiles': radius, 'filter.limit': 1}
+            )
+            locs = response.json()
+        except Exception:
+            return None
+        if not locs.get("data"):
+            return None
+        store = locs["data"][0]
+        location = {'location_id': store["locationId"], 'name': store.get("name", "Unknown Store")}
+        # LocationCache.set may write its JSON file; keep that off the event loop
+        await asyncio.to_thread(self.location_cache.set, zip_code, radius, location)
+        return location
+
+    async def _fetch_products(self, search_term, limit, location_id):
+        async with self._search_slots:
+            response = await self._service_request(
+                'GET', f"{self.base_url}/v1/products",
+                params={'filter.term': search_term, 'filter.locationId': location_id, 'filter.limit': limit}
+            )
+        if response.status_code != 200:
+            raise KrogerAPIError(f"Product search failed with status {response.status_code}")
+        return parse_products(response.json(), location_id)
+
+    async def _run_fetch(self, key, future, search_term, limit, location_id):
+        try:
+            products = await self._fetch_products(search_term, limit, location_id)
+            self.search_cache.set(key, (products, time.monotonic()))
+            future.set_result(products)
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be awaiting a background refresh; mark the error as seen.
+            future.exception()
+        finally:
+            self._inflight.pop(key, None)
+            # Cancelled (e.g. by aclose()): release the waiters instead of leaving them pending
+            if not future.done():
+                future.cancel()
+
+    def _claim_fetch(self, key):
+        future = self._inflight.get(key)
+        if future is not None:
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future, True
+
+    async def _cached_fetch_products(self, search_term, limit, location_id):
+        """Search cache with stale-while-revalidate and single-flight misses, as in KrogerAPI."""
+        key = search_cache_key(search_term, limit, location_id)
+        entry = self.search_cache.get(key)
+        if entry is not None:
+            products, fetched_at = entry
+            if time.monotonic() - fetched_at > self.search_fresh_ttl:
+                future, owner = self._claim_fetch(key)
+                if owner:
+                    self._spawn(self._run_fetch(key, future, search_term, limit, location_id))
+            return list(products)
+        future, owner = self._claim_fetch(key)
+        if owner:
+            # Run the fetch as its own task so cancelling this caller (say, a client
+            # disconnect) doesn't strand the other requests waiting on the same key
+            self._spawn(self._run_fetch(key, future, search_term, limit, location_id))
+        return list(await asyncio.shield(future))
+
+    async def productSearch(self, search_term, limit=1, zip_code=None, location_id=None):
+        """
+        Search for products and return Product objects.
+
+        Returns:
+            list: List of Product objects, or empty list if failed
+        """
+        if not location_id:
+            location = await self.resolveLocation(zip_code)
+            if location is None:
+                return []
+            location_id = location['location_id']
+        try:
+            return await self._cached_fetch_products(search_term, limit, location_id)
+        except Exception:
+            return []
+
+    async def productSearchMany(self, terms, limit=1, zip_code=None, location_id=None):
+        """
+        Search for several products concurrently (bounded by KROGER_ASYNC_MAX_CONCURRENCY).
+
+        Returns:
+            list: One dict per term, in input order:
+                {'term': str, 'products': [Product, ...], 'error': str or None}
+        """
+        if not terms:
+            return []
+        if not location_id:
+            location = await self.resolveLocation(zip_code)
+            if location is None:
+                return [{'term': t, 'products': [], 'error': "No Kroger store found near the given ZIP code"} for t in terms]
+            location_id = location['location_id']
+
+        outcomes = await asyncio.gather(
+            *(self._cached_fetch_products(term, limit, location_id) for term in terms),
+            return_exceptions=True
+        )
+        return [
+            {'term': term, 'products': [], 'error': str(outcome) or type(outcome).__name__}
+            if isinstance(outcome, Exception) else
+            {'term': term, 'products': outcome, 'error': None}
+            for term, outcome in zip(terms, outcomes)
+        ]
+
+    # --- Cart ---
+
+    async def _refresh_token(self, user_id=None):
+        """
+        Refresh a user's cart token; see KrogerAPI._refresh_token.
+
+        TokenStore.refresh is blocking (DatabaseTokenStore holds the users row lock
+        while it runs), so it runs on a worker thread and the token request is
+        handed back to this loop.
+        """
+        loop = asyncio.get_running_loop()
+
+        def exchange(token_info):
+            return asyncio.run_coroutine_threadsafe(self._exchange_refresh_token(token_info), loop).result()
+
+        async with self._user_token_locks[user_lock_stripe(user_id)]:
+            return await asyncio.to_thread(self.token_store.refresh, user_id, exchange)
+
+    async def _exchange_refresh_token(self, token_info):
+        """New tokens for `token_info`, itself if still fresh, or None if the refresh failed."""
+        if not user_token_expiring(token_info):
+            return token_info
+        refresh_token = token_info.get('refresh_token')
+        if not refresh_token:
+            return None
+        try:
+            # Not retried: the refresh token may be single-use (see KrogerAPI._refresh_token)
+            response = await self._request(
+                'POST', f"{self.base_url}/v1/connect/oauth2/token", idempotent=False,
+                headers={
+                    'Authorization': self._get_auth_header(),
+                    'Content-Type': 'application/x-www-form-urlencoded'
+                },
+                data={'grant_type': 'refresh_token', 'refresh_token': refresh_token}
+            )
+        except Exception:
+            return None
+        if response.status_code != 200:
+            return None
+        new_token_info = response.json()
+        new_token_info['expires_at'] = time.time() + new_token_info.get('expires_in', 1800)
+        new_token_info.setdefault('refresh_token', refresh_token)
+        return new_token_info
+
+    async def _get_valid_token(self, user_id=None):
+        """Get a valid cart access token for a user, refreshing if necessary."""
+        token_info = await asyncio.to_thread(self.token_store.load, user_id)
+        if not token_info:
+            return None
+        if user_token_expiring(token_info):
+            token_info = await self._refresh_token(user_id)
+            if not token_info:
+                return None
+        return token_info.get('access_token')
+
+    async def addToCart(self, upc, quantity=1, modality="PICKUP", user_id=None):
+        """
+        Add item to user's Kroger cart.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        access_token = await self._get_valid_token(user_id)
+        if not access_token:
+            return False
+        try:
+            response = await self._request(
+                'PUT', f"{self.base_url}/v1/cart/add", idempotent=False,
+                headers={'Authorization': f"Bearer {access_token}", 'Content-Type': 'application/json'},
+                json={"items": [{"upc": upc, "quantity": quantity, "modality": modality}]}
+            )
+        except Exception:
+            return False
+        return response.status_code == 204
@@ -0,0 +1,181 @@
+"""
+Content-addressed cache for LLM generate_content calls.
+
+Responses are keyed by a hash of (model, contents, config), kept in a TTLCache
+in memory and mirrored to a SQLite file so a restarted worker doesn't pay for
+the same prompt again. SQLite rather than a JSON file (as LocationCache uses)
+because every miss writes a new entry and responses are kilobytes each.
+"""
+import hashlib
+import inspect
+import json
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+
+def _json_default(value):
+    """Stable stand-ins for config values json can't encode (tool functions, schema types, models)."""
+    if inspect.isfunction(value) or inspect.ismethod(value) or inspect.isclass(value):
+        return f"{value.__module__}.{value.__qualname__}"
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    return repr(value)
+
+def generation_key(model, contents, config=None):
+    """Hex digest identifying a generate_content request."""
+    config_fields = {}
+    if config is not None:
+        fields = config if isinstance(config, dict) else vars(config)
+        config_fields = {k: v for k, v in fields.items() if v is not None}
+    payload = json.dumps(
+        {"model": model, "contents": contents, "config": config_fields},
+        sort_keys=True, default=_json_default
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CachedResponse:
+    """The parts of a generate_content response callers use: .text and, for structured output, .parsed."""
+
+    __slots__ = ("text", "parsed", "cached")
+
+    def __init__(self, text, parsed=None, cached=False):
+        self.text = text
+        self.parsed = parsed
+        self.cached = cached
+
+class GenerationCache:
+    """
+    Size-bounded, TTL'd cache of generated text.
+
+    Args:
+        path: SQLite file to persist entries to, or None for memory only
+        ttl: Seconds an entry stays valid
+        maxsize: Maximum entries kept, in memory and on disk; least recently used go first
+    """
+
+    def __init__(self, path=None, ttl=24 * 3600, maxsize=2000, name="llm_generate"):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl, name=name)
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "disk_evictions": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_last_access ON generations (last_access)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def get(self, key):
+        """Returns the cached text for `key`, or None."""
+        text = self._memory.get(key)
+        if text is not None:
+            with self._lock:
+                self._stats["hits"] += 1
+            return text
+        if self.path:
+            now = time.time()
+            try:
+                with self._lock:
+                    conn = self._connect()
+                    try:
+                        row = conn.execute(
+                            "SELECT text, expires_at FROM generations WHERE key = ? AND expires_at > ?", (key, now)
+                        ).fetchone()
+                        if row:
+                            conn.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+                            conn.commit()
+                    finally:
+                        conn.close()
+            except sqlite3.Error as e:
+                print(f"Generation cache read failed: {e}")
+                row = None
+            if row:
+                text, expires_at = row
+                self._memory.set(key, text, ttl=expires_at - now)
+                with self._lock:
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                return text
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key, text, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._memory.set(key, text, ttl=ttl)
+        if not self.path:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO generations (key, text, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                        (key, text, now + ttl, now)
+                    )
+                    conn.execute("DELETE FROM generations WHERE expires_at <= ?", (now,))
+                    evicted = conn.execute("""
+                        DELETE FROM generations WHERE key IN (
+                            SELECT key FROM generations ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                        )
+                    """, (self.maxsize,)).rowcount
+                    conn.commit()
+                    self._stats["disk_evictions"] += max(evicted, 0)
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            print(f"Generation cache write failed: {e}")
+
+    def stats(self):
+        """Hit/miss counters across both tiers, plus the memory tier's own stats."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+        snapshot["memory"] = self._memory.stats()
+        return snapshot
+
+def cached_generate_content(client, cache, model, contents, config=None, ttl=None, parse=None):
+    """
+    client.models.generate_content, memoized in `cache`.
+
+    Args:
+        parse: Optional callable turning the response text back into the
+            structured `.parsed` value on a cache hit (e.g. a pydantic
+            TypeAdapter's validate_json)
+
+    Returns:
+        CachedResponse
+    """
+    key = generation_key(model, contents, config)
+    text = cache.get(key)
+    if text is not None:
+        parsed = None
+        if parse is not None:
+            try:
+                parsed = parse(text)
+            except ValueError:
+                parsed = None
+        return CachedResponse(text, parsed, cached=True)
+
+    response = client.models.generate_content(model=model, contents=contents, config=config)
+    text = response.text
+    if text:
+        cache.set(key, text, ttl=ttl)
+    return CachedResponse(text, getattr(response, "parsed", None))
@@ -1,14 +1,32 @@
+import asyncio
+import hashlib
 import httpx
 import os
 from dotenv import load_dotenv
 import json
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from cache import TTLCache
 
 # Load environment variables
 load_dotenv()
 
 QLOO_API_KEY = os.getenv("QLOO_API_KEY")
 QLOO_BASE_URL = os.getenv("QLOO_BASE_URL", "https://hackathon.api.qloo.com").rstrip("/")
+QLOO_TIMEOUT = float(os.getenv("QLOO_TIMEOUT", "30"))
+QLOO_POOL_SIZE = int(os.getenv("QLOO_POOL_SIZE", "10"))
+QLOO_CACHE_TTL = float(os.getenv("QLOO_CACHE_TTL", "3600"))
+QLOO_CACHE_SIZE = int(os.getenv("QLOO_CACHE_SIZE", "2048"))
+
+# Shared keep-alive client so insight calls reuse connections
+_http_client = httpx.Client(
+    base_url=QLOO_BASE_URL,
+    headers={"X-Api-Key": QLOO_API_KEY or ""},
+    timeout=QLOO_TIMEOUT,
+    limits=httpx.Limits(max_connections=QLOO_POOL_SIZE, max_keepalive_connections=QLOO_POOL_SIZE)
+)
+
+# Insights responses keyed by canonicalized request params; many users share a profile shape
+_insights_cache = TTLCache(maxsize=QLOO_CACHE_SIZE, ttl=QLOO_CACHE_TTL, name="qloo_insights")
 
 class UserProfile:
     """User profile for food recommendations"""
@@ -56,39 +74,56 @@ def build_qloo_signals(user_profile: UserProfile, bias_trends: str = "medium") -
     return signals
 
 
+def canonicalize_params(params: Dict) -> Dict:
+    """Normalize insight params so equivalent requests look identical (deduplicated, sorted tags)."""
+    canonical = dict(params)
+    tags = canonical.get("signal.interests.tags")
+    if isinstance(tags, str):
+        canonical["signal.interests.tags"] = ",".join(sorted({t.strip() for t in tags.split(",") if t.strip()}))
+    return canonical
+
+def insights_cache_key(params: Dict) -> Tuple:
+    """Hashable cache key for canonicalized insight params."""
+    return tuple(sorted((key, str(value)) for key, value in params.items()))
+
+def signal_fingerprint(params: Dict) -> str:
+    """Stable hex digest of canonical insight params, for keying persisted results."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
 def qloo_insights(filter_type: str, take: int, **signals) -> Optional[Dict]:
-    """Generic Qloo insights API call"""
-    headers = {
-        "X-Api-Key": QLOO_API_KEY
-    }
-    
-    params = {
+    """Generic Qloo insights API call, served from the insights cache when possible"""
+    params = canonicalize_params({
         "filter.type": filter_type,
         "take": take,
         **signals
-    }
+    })
+    key = insights_cache_key(params)
+    cached = _insights_cache.get(key)
+    if cached is not None:
+        return cached
     
-    response = httpx.get(
-        f"{QLOO_BASE_URL}/v2/insights",
-        params=params,
-        headers=headers,
-        timeout=30.0
-    )
+    response = _http_client.get("/v2/insights", params=params)
     
     if response.status_code == 200:
-        return response.json()
+        data = response.json()
+        _insights_cache.set(key, data)
+        return data
     else:
         print(f"Error: {response.status_code} - {response.text}")
         return None
 
-def get_food_recommendations(user_profile: UserProfile, take: int = 50) -> Optional[List[Dict]]:
-    """Get food recommendations using Qloo's cross-domain embedding magic"""
-    
+def qloo_cache_stats() -> Dict:
+    """Hit/miss/eviction counters for the insights cache."""
+    return _insights_cache.stats()
+
+def build_recommendation_params(user_profile: UserProfile, take: int = 50) -> Optional[Dict]:
+    """
+    Canonical insights params for a profile's specialty-dish recommendations,
+    or None if the profile has no favorite tags to recommend from.
+    """
     if not user_profile.favorite_tags:
-        return []
-    
+        return None
 
-    
     # Build all Qloo signals with correct formats
     signals = build_qloo_signals(user_profile, bias_trends="medium")
     
@@ -97,16 +132,25 @@ def get_food_recommendations(user_profile: UserProfile, take: int = 50) -> Optio
         existing_tags = signals.get("signal.interests.tags", "")
         all_tags = ([existing_tags] if existing_tags else []) + user_profile.dietary_restrictions
         signals["signal.interests.tags"] = ",".join(all_tags)
-    
 
+    return canonicalize_params({
+        "filter.type": "urn:tag",
+        "take": take,
+        "filter.tag.types": "urn:tag:specialty_dish:place",
+        **signals
+    })
+
+def get_food_recommendations(user_profile: UserProfile, take: int = 50) -> Optional[List[Dict]]:
+    """Get food recommendations using Qloo's cross-domain embedding magic"""
+    
+    params = build_recommendation_params(user_profile, take)
+    if params is None:
+        return []
     
     # Call Qloo with working signals only
-    response = qloo_insights(
-        filter_type="urn:tag",
-        take=take,
-        **{"filter.tag.types": "urn:tag:specialty_dish:place"},
-        **signals
-    )
+    filter_type = params.pop("filter.type")
+    take = params.pop("take")
+    response = qloo_insights(filter_type=filter_type, take=take, **params)
     
     tags = response.get("results", {}).get("tags", []) if response else []
     
@@ -114,50 +158,135 @@ def get_food_recommendations(user_profile: UserProfile, take: int = 50) -> Optio
         print("No specialty dish recommendations found from API")
         return []
     
-
-
-    
     return tags
 
+def parse_recommendation_tags(food_recommendations: List[Dict]) -> List[Dict]:
+    """Reduce raw Qloo tag results to the fields the app uses"""
+    return [
+        {
+            "name": t.get("name", "Unknown"),
+            "tag_id": t.get("tag_id", t.get("id", "")),
+            "type": t.get("subtype", t.get("type", "")),
+            "affinity": t.get("query", {}).get("affinity", 0),
+            "weight": t.get("weight", 0)
+        } for t in food_recommendations
+    ]
 
-def food_recommender_workflow(user_profile: UserProfile) -> Dict:
-    """Complete food recommendation workflow using API-driven recommendations"""
-
-    
-    # Step 1: Signal Collection (already done in user_profile)
-
-    
-    # Step 2: Get food recommendations from API
-
-    food_recommendations = get_food_recommendations(user_profile, take=50)
-    
+def package_workflow_results(user_profile: UserProfile, food_recommendations: List[Dict]) -> Dict:
+    """Shape raw recommendation tags into the workflow result dict"""
     if not food_recommendations:
         return {"error": "No food recommendations found"}
-    
 
-    
-    # Step 3: Package results
-    results = {
+    return {
         "user_profile": {
             "age": user_profile.age,
             "city": user_profile.city,
             "food_interests": user_profile.favorite_tags
         },
-        "food_recommendations": [
-            {
-                "name": t.get("name", "Unknown"),
-                "tag_id": t.get("tag_id", t.get("id", "")),
-                "type": t.get("subtype", t.get("type", "")),
-                "affinity": t.get("query", {}).get("affinity", 0),
-                "weight": t.get("weight", 0)
-            } for t in food_recommendations
-        ],
+        "food_recommendations": parse_recommendation_tags(food_recommendations),
         "raw_data": {
             "food_recommendations": food_recommendations
         }
     }
-    
-    return results
+
+def food_recommender_workflow(user_profile: UserProfile) -> Dict:
+    """Complete food recommendation workflow using API-driven recommendations"""
+
+    # Step 1: Signal Collection (already done in user_profile)
+
+    # Step 2: Get food recommendations from API
+    food_recommendations = get_food_recommendations(user_profile, take=50)
+
+    # Step 3: Package results
+    return package_workflow_results(user_profile, food_recommendations)
+
+class AsyncRateLimiter:
+    """Spaces request starts at least 1/rate seconds apart across all callers."""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+async def _async_qloo_insights(client: httpx.AsyncClient, params: Dict,
+                               semaphore: asyncio.Semaphore, limiter: AsyncRateLimiter) -> Optional[Dict]:
+    """qloo_insights for the batch path; shares the insights cache with the sync path"""
+    key = insights_cache_key(params)
+    cached = _insights_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async with semaphore:
+        await limiter.acquire()
+        response = await client.get("/v2/insights", params=params)
+
+    if response.status_code == 200:
+        data = response.json()
+        _insights_cache.set(key, data)
+        return data
+    print(f"Error: {response.status_code} - {response.text}")
+    return None
+
+async def batch_food_recommender_workflow(user_profiles: Iterable[UserProfile], take: int = 50,
+                                          max_concurrency: int = 8,
+                                          requests_per_second: float = 10.0) -> AsyncIterator[Tuple[UserProfile, Dict]]:
+    """
+    Run food_recommender_workflow for many profiles, yielding (profile, results) as they complete.
+
+    Profiles are grouped by their canonical insights params, so each distinct signal
+    set costs at most one Qloo request (zero if already cached). Requests run
+    concurrently, capped at `max_concurrency` in flight and `requests_per_second` starts.
+    A group whose request fails in any way yields an error result for each of its
+    profiles; the other groups carry on.
+
+    Usage:
+        async for profile, results in batch_food_recommender_workflow(profiles):
+            ...
+    """
+    groups: Dict[Tuple, Tuple[Dict, List[UserProfile]]] = {}
+    for user_profile in user_profiles:
+        params = build_recommendation_params(user_profile, take)
+        if params is None:
+            yield user_profile, package_workflow_results(user_profile, [])
+            continue
+        key = insights_cache_key(params)
+        groups.setdefault(key, (params, []))[1].append(user_profile)
+
+    if not groups:
+        return
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    limiter = AsyncRateLimiter(requests_per_second)
+
+    async with httpx.AsyncClient(
+        base_url=QLOO_BASE_URL,
+        headers={"X-Api-Key": QLOO_API_KEY or ""},
+        timeout=QLOO_TIMEOUT,
+        limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    ) as client:
+        async def run_group(params, members):
+            # Any failure (HTTP error, a non-JSON body, an unexpected shape) is
+            # confined to this group so the rest of the batch still completes.
+            try:
+                data = await _async_qloo_insights(client, params, semaphore, limiter)
+                tags = data.get("results", {}).get("tags", []) if data else []
+            except Exception as e:
+                print(f"Error: {e}")
+                tags = []
+            return members, tags
+
+        for next_done in asyncio.as_completed([run_group(params, members) for params, members in groups.values()]):
+            members, tags = await next_done
+            for user_profile in members:
+                yield user_profile, package_workflow_results(user_profile, tags)
 
 def parse_search_results(search_data):
     """Parse search results into readable format"""
@@ -0,0 +1,195 @@
+"""
+Precomputed Qloo recommendations, stored in Postgres by signal fingerprint.
+
+Recommendations depend only on the canonical insights params built from a
+profile (interest tags, dietary restrictions, age bucket, gender), so users with
+the same signals share one stored row. Reads never wait on Qloo: a missing or
+stale row is recomputed on a background thread and the caller gets whatever is
+stored right now.
+
+Run from backend/ to precompute for every user (e.g. from a nightly cron):
+    python recommendations.py
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from Database import db_utils
+from qloo import (
+    UserProfile, batch_food_recommender_workflow, build_recommendation_params,
+    parse_recommendation_tags, qloo_insights, signal_fingerprint
+)
+
+RECOMMENDATION_TAKE = 50
+RECOMMENDATION_MAX_AGE = timedelta(hours=float(os.getenv("RECOMMENDATION_MAX_AGE_HOURS", "24")))
+RECOMMENDATION_WORKERS = int(os.getenv("RECOMMENDATION_WORKERS", "2"))
+# After a failed refresh, reads of that fingerprint don't retry Qloo for this many seconds
+RECOMMENDATION_RETRY_BACKOFF = float(os.getenv("RECOMMENDATION_RETRY_BACKOFF", "300"))
+
+CUISINE_TAG_PREFIX = "urn:tag:genre:place:restaurant:"
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+# fingerprint -> time.monotonic() of its last failed refresh
+_failed_at = {}
+_pending_lock = threading.Lock()
+
+def _cuisine_tags(cuisines) -> List[str]:
+    """Maps setup-page cuisine names ('Italian') to Qloo restaurant genre tags."""
+    return [CUISINE_TAG_PREFIX + c.strip().lower().replace(" ", "_") for c in (cuisines or []) if c and c.strip()]
+
+def _dietary_urns(restrictions) -> List[str]:
+    # Only URNs are meaningful to Qloo; free-text restrictions are skipped.
+    return [r for r in (restrictions or []) if isinstance(r, str) and r.startswith("urn:")]
+
+def user_profile_from_user(user) -> UserProfile:
+    """Builds the Qloo UserProfile for a Database User."""
+    return UserProfile(
+        age=user.age,
+        gender=user.gender,
+        city=user.preferred_location,
+        favorite_tags=_cuisine_tags(user.favorite_cuisines),
+        dietary_restrictions=_dietary_urns(user.dietary_restrictions)
+    )
+
+def _is_stale(computed_at) -> bool:
+    return computed_at is None or datetime.now(timezone.utc) - computed_at > RECOMMENDATION_MAX_AGE
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=RECOMMENDATION_WORKERS, thread_name_prefix="recommendations")
+        return _executor
+
+def compute_recommendations(fingerprint: str, params: Dict) -> Optional[List[Dict]]:
+    """
+    Calls Qloo for `params` and stores the parsed result under `fingerprint`.
+
+    Returns:
+        list: The stored recommendations, or None if Qloo or the write failed
+    """
+    signals = dict(params)
+    filter_type = signals.pop("filter.type")
+    take = signals.pop("take")
+    response = qloo_insights(filter_type=filter_type, take=take, **signals)
+    if response is None:
+        return None
+    recommendations = parse_recommendation_tags(response.get("results", {}).get("tags", []))
+    if not db_utils.save_recommendation_set(fingerprint, params, recommendations):
+        return None
+    return recommendations
+
+def _refresh(fingerprint: str, params: Dict):
+    succeeded = False
+    try:
+        succeeded = compute_recommendations(fingerprint, params) is not None
+    except Exception as e:
+        print(f"Error precomputing recommendations: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(fingerprint)
+            if succeeded:
+                _failed_at.pop(fingerprint, None)
+            else:
+                now = time.monotonic()
+                # Drop expired entries so the map only holds fingerprints still backing off
+                for key in [k for k, t in _failed_at.items() if now - t >= RECOMMENDATION_RETRY_BACKOFF]:
+                    del _failed_at[key]
+                _failed_at[fingerprint] = now
+
+def schedule_refresh(fingerprint: str, params: Dict) -> bool:
+    """
+    Queues a background recompute unless one is already pending for this
+    fingerprint, or its last attempt failed less than RECOMMENDATION_RETRY_BACKOFF ago.
+    """
+    with _pending_lock:
+        if fingerprint in _pending:
+            return False
+        failed_at = _failed_at.get(fingerprint)
+        if failed_at is not None and time.monotonic() - failed_at < RECOMMENDATION_RETRY_BACKOFF:
+            return False
+        _pending.add(fingerprint)
+    _get_executor().submit(_refresh, fingerprint, params)
+    return True
+
+def get_recommendations(user_profile: UserProfile) -> Dict:
+    """
+    Returns the stored recommendations for a profile without calling Qloo.
+
+    A missing or stale row schedules a background recompute (unless a recent one
+    failed); until it lands the caller gets the previous result (or an empty
+    list the first time).
+
+    Returns:
+        dict: {'recommendations', 'computed_at', 'refreshing'}
+    """
+    params = build_recommendation_params(user_profile, RECOMMENDATION_TAKE)
+    if params is None:
+        return {"recommendations": [], "computed_at": None, "refreshing": False}
+
+    fingerprint = signal_fingerprint(params)
+    stored = db_utils.get_recommendation_set(fingerprint)
+    computed_at = stored["computed_at"] if stored else None
+    refreshing = False
+    if _is_stale(computed_at):
+        # False while backing off from a failed refresh
+        scheduled = schedule_refresh(fingerprint, params)
+        with _pending_lock:
+            refreshing = scheduled or fingerprint in _pending
+
+    return {
+        "recommendations": stored["recommendations"] if stored else [],
+        "computed_at": computed_at.isoformat() if computed_at else None,
+        "refreshing": refreshing
+    }
+
+def warm_recommendations(user_profile: UserProfile) -> bool:
+    """Schedules a recompute if the profile's stored recommendations are missing or stale."""
+    return get_recommendations(user_profile)["refreshing"]
+
+async def precompute_recommendations(user_profiles: Iterable[UserProfile], max_concurrency: int = 8,
+                                     requests_per_second: float = 10.0) -> int:
+    """
+    Computes and stores recommendations for many profiles at once.
+
+    Profiles sharing a fingerprint cost a single Qloo request and a single write.
+
+    Returns:
+        int: Number of recommendation sets written
+    """
+    written = set()
+    async for user_profile, results in batch_food_recommender_workflow(
+        user_profiles, take=RECOMMENDATION_TAKE,
+        max_concurrency=max_concurrency, requests_per_second=requests_per_second
+    ):
+        if "error" in results:
+            continue
+        params = build_recommendation_params(user_profile, RECOMMENDATION_TAKE)
+        fingerprint = signal_fingerprint(params)
+        if fingerprint in written:
+            continue
+        if await asyncio.to_thread(db_utils.save_recommendation_set, fingerprint, params, results["food_recommendations"]):
+            written.add(fingerprint)
+    return len(written)
+
+def precompute_all_users() -> int:
+    """Precomputes recommendations for every user in the database."""
+    profiles = [
+        UserProfile(
+            age=row["age"],
+            gender=row["gender"],
+            favorite_tags=_cuisine_tags(row["favorite_cuisines"]),
+            dietary_restrictions=_dietary_urns(row["dietary_restrictions"])
+        )
+        for row in db_utils.get_all_profile_signals()
+    ]
+    return asyncio.run(precompute_recommendations(profiles))
+
+if __name__ == "__main__":
+    print(f"✅ Stored {precompute_all_users()} recommendation sets")
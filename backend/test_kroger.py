@@ -8,8 +8,8 @@ After initial setup, cart functions work seamlessly without re-authorization.
 """
 
 # Create a single shared KrogerAPI instance
-from kroger import KrogerAPI
-kroger = KrogerAPI()
+from kroger import KrogerAPI, FileTokenStore
+kroger = KrogerAPI(token_store=FileTokenStore('kroger_tokens.json'))
 
 # Import methods directly from the instance
 productSearch = kroger.productSearch